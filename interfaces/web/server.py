@@ -12,6 +12,7 @@ from src.framework import load_config_from_file, StorageManager
 from src.framework.outliers import (
     get_ranking_for_components,
     get_outliers_for_train,
+    get_hourly_outliers_count_for_train,
 )
 
 # Create a FastAPI instance
@@ -34,7 +35,7 @@ logging.basicConfig(level=logging.INFO)
 # Load the global and component configuration
 config = load_config_from_file("config.toml")
 # Instantiate the storage manager, which handles all data storage for the components
-storage_manager = StorageManager(config.storage_folder)
+storage_manager = StorageManager.from_config(config)
 
 available_components = []
 
@@ -85,7 +86,16 @@ def get_outliers(
     component_name: str,
     train_id: Optional[str] = None,
 ):
-    outliers = get_outliers_for_train(train_id, component_name, storage_manager)
+    # With an hourly rollup, the evolution is read pre-aggregated and only the positions of the outliers are read
+    evolution = get_hourly_outliers_count_for_train(
+        train_id, component_name, storage_manager
+    )
+    outliers = get_outliers_for_train(
+        train_id,
+        component_name,
+        storage_manager,
+        columns=None if evolution is None else ["lat", "lon"],
+    )
 
     response = {}
 
@@ -119,15 +129,17 @@ def get_outliers(
         response["map"] = base64_plot
         plt.close()
 
-    # round timestamp to hour (is DateTimeIndex)
-    outliers["t"] = outliers.index.round("H")
-    # count outliers per hour
-    outliers = outliers.groupby("t").count()
+    if evolution is None:
+        # round timestamp to hour (is DateTimeIndex)
+        outliers["t"] = outliers.index.round("H")
+        # count outliers per hour
+        outliers = outliers.groupby("t").count()
+        evolution = outliers[outliers.columns[0]]
 
     # Plot the evolution of the outliers
     plt.bar(
-        x=outliers.index,
-        height=outliers[outliers.columns[0]],
+        x=evolution.index,
+        height=evolution,
     )
 
     buffer = io.BytesIO()
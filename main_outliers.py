@@ -19,7 +19,7 @@ if __name__ == "__main__":
     # Load the global and component configuration
     config = load_config_from_file("config.toml")
     # Instantiate the storage manager, which handles all data storage for the components
-    storage_manager = StorageManager(config.storage_folder)
+    storage_manager = StorageManager.from_config(config)
 
     rankings = []
 
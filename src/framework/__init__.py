@@ -1,6 +1,12 @@
+from .cache import *
+from .compaction import *
 from .component import *
 from .config import *
+from .metrics import *
+from .notifications import *
 from .period import *
+from .retention import *
 from .runner import *
 from .runner_persistence import *
 from .storage import *
+from .tracing import *
@@ -0,0 +1,80 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+__all__ = ["TableCache"]
+
+
+class TableCache:
+    """
+    A memory-bounded LRU cache of decoded Arrow tables (and parquet metadata), shared by the threads of a process.
+
+    Keys include the mtime and size of the file the value was decoded from, so a rewritten file never hits stale
+    entries (the stale entries are evicted as they become the least recently used).
+
+    Attributes:
+        max_bytes (int): The memory budget of the cache, in bytes.
+        nbytes (int): The amount of bytes currently held by the cache.
+        hits (int): The amount of lookups that found their entry.
+        misses (int): The amount of lookups that did not find their entry.
+
+    Methods:
+        get(key): Gets an entry, marking it as the most recently used.
+        put(key, value, nbytes): Adds an entry, evicting the least recently used entries to fit the budget.
+        stats(): Gets the counters of the cache.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Each process starts with an empty cache (the lock can not be pickled anyway)
+        return {"max_bytes": self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state["max_bytes"])
+
+    def get(self, key: Hashable) -> Any:
+        """Get an entry (None if missing), marking it as the most recently used."""
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, nbytes: int):
+        """Add an entry, evicting the least recently used entries to fit the budget."""
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.nbytes -= evicted_bytes
+
+    def stats(self) -> Dict[str, int]:
+        """Get the counters of the cache."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "bytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+        }
@@ -0,0 +1,169 @@
+import logging
+import os
+import time
+
+import pyarrow
+
+from src.framework.config import load_config_from_file, StorageOptions
+from src.framework.manifest import Manifest
+from src.framework.storage import (
+    StorageManager,
+    _base_file,
+    _merge_partition,
+    _partition_location,
+)
+
+__all__ = ["compact_partition", "compact_storage", "run_compaction"]
+
+logger = logging.getLogger(__name__)
+
+
+class _RateLimiter:
+    """
+    Limit the throughput of the compaction, so it does not starve the component processes from disk I/O.
+
+    Attributes:
+        max_bytes_per_second (int): The maximum amount of bytes compacted per second (None means unlimited).
+    """
+
+    def __init__(self, max_bytes_per_second: int = None):
+        self.max_bytes_per_second = max_bytes_per_second
+
+    def consume(self, amount: int):
+        """Sleep long enough for the given amount of bytes to fit into the allowed throughput."""
+        if self.max_bytes_per_second:
+            time.sleep(amount / self.max_bytes_per_second)
+
+
+def compact_partition(
+    files,
+    row_group_size: int = None,
+    manifest: Manifest = None,
+    options: StorageOptions = None,
+    extension: str = ".parquet",
+) -> int:
+    """
+    Merge the base file and the deltas of a daily partition into a single sorted and deduplicated base file.
+
+    The new base file is written to a temporary file and renamed over the previous one, then the merged deltas are
+    removed. Readers listing the partition in the meantime either read the merged base file or retry when a delta
+    disappears, so they never see a half-written file nor miss rows.
+
+    :param files: The files of the partition, the base file first followed by its deltas in write order
+    :param row_group_size: The maximum number of rows per row group of the base file
+    :param manifest: Optional, the manifest to update with the new base file
+    :param options: Optional, the storage options (parquet encoding) of the dataset
+    :param extension: The extension of the base file, .arrow for the partitions of the hot tier (default: .parquet)
+    :return: The amount of bytes read from the partition files
+    """
+    size = sum(os.path.getsize(file) for file in files)
+
+    _merge_partition(files, extension, options, row_group_size, manifest)
+
+    return size
+
+
+def _needs_compaction(files, is_last: bool, min_deltas: int, extension: str) -> bool:
+    """
+    Check whether a partition should be compacted. Past partitions are compacted as soon as they hold a delta, while
+    the last partition (still being written to) is only compacted once enough deltas accumulated. Partitions holding
+    files of the wrong tier (e.g. Arrow IPC files older than the hot tier) are always compacted.
+    """
+    if any(not file.endswith(extension) for file in files):
+        return True
+
+    deltas = len(files) - (1 if files[0] == _base_file(files, extension) else 0)
+
+    if is_last:
+        return deltas >= min_deltas
+
+    return deltas > 0
+
+
+def compact_storage(
+    storage_manager: StorageManager,
+    min_deltas: int = 10,
+    row_group_size: int = None,
+    rate_limiter: _RateLimiter = None,
+):
+    """
+    Compact every daily partition of the storage that holds deltas, and move the partitions that fell out of the hot
+    tier to parquet.
+
+    :param storage_manager: The storage manager whose folder is compacted
+    :param min_deltas: The amount of deltas required before compacting the last partition of a directory
+    :param row_group_size: The maximum number of rows per row group of the compacted files
+    :param rate_limiter: Optional, limits the amount of bytes compacted per second
+    """
+    rate_limiter = rate_limiter or _RateLimiter()
+
+    for directory, _, _ in os.walk(storage_manager.path):
+        partitions = storage_manager._list_partitions(directory)
+        # The dataset is the first directory under the storage folder
+        name = os.path.relpath(directory, storage_manager.path).split(os.sep)[0]
+
+        if not partitions:
+            continue
+
+        latest = _partition_location(partitions[-1][0])[1]
+
+        for index, files in enumerate(partitions):
+            extension = storage_manager._file_extension(
+                _partition_location(files[0])[1], latest
+            )
+
+            if not _needs_compaction(
+                files, index == len(partitions) - 1, min_deltas, extension
+            ):
+                continue
+
+            try:
+                size = compact_partition(
+                    files,
+                    row_group_size,
+                    storage_manager._manifest,
+                    storage_manager.dataset_options.get(name),
+                    extension,
+                )
+            except (pyarrow.lib.ArrowInvalid, OSError) as error:
+                logger.warning("Could not compact partition %s: %s", files[0], error)
+                continue
+
+            logger.debug(
+                "Compacted %d files into %s", len(files), _base_file(files, extension)
+            )
+            rate_limiter.consume(size)
+
+
+def _run_compaction_for_ever(
+    storage_manager: StorageManager,
+    interval: float,
+    min_deltas: int,
+    row_group_size: int,
+    max_bytes_per_second: int,
+):
+    """Compact the storage forever, waiting for the given interval (in seconds) between two passes."""
+    rate_limiter = _RateLimiter(max_bytes_per_second)
+
+    while True:
+        compact_storage(storage_manager, min_deltas, row_group_size, rate_limiter)
+        time.sleep(interval)
+
+
+def run_compaction(config_path: str = "config.toml"):
+    """
+    Run the compaction service forever, it can be run next to the pipeline (see the compaction settings of the
+    configuration file).
+
+    :param config_path: The path to the configuration file (default: config.toml)
+    :return: None
+    """
+    config = load_config_from_file(config_path)
+
+    _run_compaction_for_ever(
+        StorageManager.from_config(config),
+        config.compaction_interval,
+        config.compaction_min_deltas,
+        config.compaction_row_group_size,
+        config.compaction_max_bytes_per_second,
+    )
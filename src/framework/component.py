@@ -6,10 +6,23 @@ __all__ = ["Component"]
 
 
 class Component(abc.ABC):
+    """
+    Base class of the components. The runner keeps one instance per component and train in each process, so the state
+    of a component (fitted scalers, spatial indexes, loaded models, ...) is kept between its runs.
+    """
+
     def __init__(self, config: dict = None):
         self.config = config or {}
         self.debug = self.config.get("debug", False)
 
+    def setup(self):
+        """Set up the component before its first run, e.g. load a model (once per instance)."""
+        pass
+
+    def teardown(self):
+        """Release the resources of the component when its process exits."""
+        pass
+
     @abc.abstractmethod
     def run(self, **sources) -> pd.DataFrame:
         """Run the component."""
@@ -1,8 +1,39 @@
 import tomllib
 from dataclasses import dataclass
-from typing import List, Dict
+from typing import List, Dict, Union
 
-__all__ = ["ConfigComponent", "ConfigDependency", "load_config_from_file"]
+__all__ = [
+    "ConfigComponent",
+    "ConfigDependency",
+    "RetentionPolicy",
+    "StorageOptions",
+    "load_config_from_file",
+]
+
+
+@dataclass
+class StorageOptions:
+    """
+    Data class representing how the output of a component is encoded in the parquet files.
+    """
+
+    compression: str = "snappy"
+    compression_level: int = None
+    use_dictionary: Union[bool, List[str]] = True
+    row_group_size: int = None
+    downcast: Dict[str, str] = None
+
+
+@dataclass
+class RetentionPolicy:
+    """
+    Data class representing how long the output of a component is kept. Ages are counted in days before the latest
+    stored day (of each train).
+    """
+
+    raw_days: int = None
+    downsample: str = None
+    delete_after_days: int = None
 
 
 @dataclass
@@ -17,6 +48,9 @@ class ConfigDependency:
     all_trains: bool = False
     components: Dict[str, "ConfigComponent"] = None
     before: bool = False
+    columns: List[str] = None
+    stream: bool = False
+    stream_batch_size: int = 10_000
 
     @property
     def name(self):
@@ -54,6 +88,14 @@ class ConfigComponent:
     settings: dict = None
     outliers_producer: bool = False
     intensity_column: str = None
+    storage: StorageOptions = None
+    rollups: List[str] = None
+    retention: RetentionPolicy = None
+    max_workers: int = None
+    max_memory: int = None
+    fused: bool = False
+    persist: bool = True
+    fused_components: List["ConfigComponent"] = None
 
 
 @dataclass
@@ -65,6 +107,23 @@ class Config:
     storage_folder: str
     runner_persistence: str
     components: Dict[str, ConfigComponent]
+    append_only: bool = False
+    read_workers: int = None
+    cache_max_bytes: int = None
+    compaction: bool = False
+    compaction_interval: float = 60
+    compaction_min_deltas: int = 10
+    compaction_row_group_size: int = 65_536
+    compaction_max_bytes_per_second: int = None
+    hot_tier_days: int = None
+    layout: str = "daily"
+    retention_interval: float = 3600
+    wakeup_interval: float = 60
+    scheduler: str = "dag"
+    workers: int = None
+    metrics_folder: str = None
+    metrics_port: int = None
+    trace_file: str = None
 
 
 def _parse_components(components) -> Dict[str, ConfigComponent]:
@@ -89,12 +148,64 @@ def _parse_components(components) -> Dict[str, ConfigComponent]:
             run_per_train=value.pop("run_per_train", True),
             outliers_producer=value.pop("outliers_producer", False),
             intensity_column=value.pop("intensity_column", None),
+            storage=StorageOptions(**value.pop("storage", {})),
+            rollups=value.pop("rollups", None),
+            retention=(
+                RetentionPolicy(**value.pop("retention"))
+                if "retention" in value
+                else None
+            ),
+            max_workers=value.pop("max_workers", None),
+            max_memory=value.pop("max_memory", None),
+            fused=value.pop("fused", False),
+            persist=value.pop("persist", True),
+            fused_components=[],
             dependencies=parsed_dependencies,
             # Pop everything else into settings
             settings=value,
         )
         parsed_components[key] = component
 
+    # Fused components are run by their dependency, on its output
+    for component in parsed_components.values():
+        if component.fused:
+            if (
+                len(component.dependencies) != 1
+                or component.dependencies[0].before
+                or component.dependencies[0].frequency
+            ):
+                raise ValueError(
+                    f"Fused component {component.name} must have a single dependency, neither before nor by frequency"
+                )
+
+            # Fused to a component running per train, it would run on the output of each train separately instead of
+            # the data of all the trains
+            if (
+                not component.run_per_train
+                and component.dependencies[0].get_component.run_per_train
+            ):
+                raise ValueError(
+                    f"Fused component {component.name} must run per train, like {component.dependencies[0].component}"
+                )
+
+            component.dependencies[0].get_component.fused_components.append(component)
+
+        # The max_memory of a component shrinks the batches of its dependencies, the periods (before or by frequency)
+        # are not shrunk since it would change the data the component sees
+        if component.max_memory and not any(
+            dependency.batch_size and not dependency.before and not dependency.frequency
+            for dependency in component.dependencies
+        ):
+            raise ValueError(
+                f"Component {component.name} sets max_memory, but none of its dependencies has a batch_size to shrink"
+            )
+
+        for dependency in component.dependencies:
+            if not dependency.get_component.persist and not component.fused:
+                raise ValueError(
+                    f"Component {component.name} must be fused to read {dependency.component}, which is not persisted"
+                )
+
     return parsed_components
 
 
@@ -111,9 +222,28 @@ def _parse_config(data: dict) -> Config:
     return Config(
         storage_folder=globals_data.get("storage_folder", "data"),
         runner_persistence=globals_data.get(
-            "runner_persistence", "data/persistence.json"
+            "runner_persistence", "data/persistence.db"
         ),
         components=components,
+        append_only=globals_data.get("append_only", False),
+        read_workers=globals_data.get("read_workers", None),
+        cache_max_bytes=globals_data.get("cache_max_bytes", None),
+        compaction=globals_data.get("compaction", False),
+        compaction_interval=globals_data.get("compaction_interval", 60),
+        compaction_min_deltas=globals_data.get("compaction_min_deltas", 10),
+        compaction_row_group_size=globals_data.get("compaction_row_group_size", 65_536),
+        compaction_max_bytes_per_second=globals_data.get(
+            "compaction_max_bytes_per_second", None
+        ),
+        hot_tier_days=globals_data.get("hot_tier_days", None),
+        layout=globals_data.get("layout", "daily"),
+        retention_interval=globals_data.get("retention_interval", 3600),
+        wakeup_interval=globals_data.get("wakeup_interval", 60),
+        scheduler=globals_data.get("scheduler", "dag"),
+        workers=globals_data.get("workers", None),
+        metrics_folder=globals_data.get("metrics_folder", None),
+        metrics_port=globals_data.get("metrics_port", None),
+        trace_file=globals_data.get("trace_file", None),
     )
 
 
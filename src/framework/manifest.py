@@ -0,0 +1,276 @@
+import contextlib
+import hashlib
+import json
+import os
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Tuple, Union
+
+import pandas as pd
+import pyarrow
+import pyarrow.compute
+import pyarrow.ipc
+import pyarrow.parquet as pq
+
+__all__ = ["Manifest", "ManifestEntry"]
+
+
+def _schema_hash(schema: pyarrow.Schema) -> str:
+    """Hash the names and types of the fields of a schema (metadata is ignored)."""
+    description = ",".join(f"{field.name}:{field.type}" for field in schema)
+    return hashlib.sha1(description.encode()).hexdigest()[:16]
+
+
+def _index_column(schema: pyarrow.Schema) -> str:
+    """Get the name of the column holding the DateTimeIndex of a parquet file written by pandas."""
+    return schema.pandas_metadata["index_columns"][0]
+
+
+def _open_arrow_file(file: str) -> pyarrow.ipc.RecordBatchFileReader:
+    """Open an Arrow IPC file (hot tier) through a memory map, its record batches are read without being copied."""
+    return pyarrow.ipc.open_file(pyarrow.memory_map(file))
+
+
+@dataclass
+class ManifestEntry:
+    """
+    Data class describing a data file of the storage, without having to read it.
+
+    The timestamps are stored as nanoseconds since epoch (None if the file is empty). The size and mtime of the file
+    are used to detect entries that are out of date.
+    """
+
+    rows: int
+    min_timestamp: Union[int, None]
+    max_timestamp: Union[int, None]
+    bytes: int
+    schema: str
+    mtime_ns: int
+
+    @property
+    def min(self) -> Union[pd.Timestamp, None]:
+        """The first timestamp of the file."""
+        return pd.Timestamp(self.min_timestamp) if self.rows else None
+
+    @property
+    def max(self) -> Union[pd.Timestamp, None]:
+        """The last timestamp of the file."""
+        return pd.Timestamp(self.max_timestamp) if self.rows else None
+
+    @staticmethod
+    def from_dataframe(file: str, df: pd.DataFrame) -> "ManifestEntry":
+        """Build the entry of a file from the dataframe that was just written to it."""
+        stat = os.stat(file)
+
+        return ManifestEntry(
+            rows=len(df),
+            min_timestamp=df.index.min().value if len(df) else None,
+            max_timestamp=df.index.max().value if len(df) else None,
+            bytes=stat.st_size,
+            schema=_schema_hash(pyarrow.Schema.from_pandas(df)),
+            mtime_ns=stat.st_mtime_ns,
+        )
+
+    @staticmethod
+    def from_file(file: str) -> "ManifestEntry":
+        """
+        Build the entry of a file from its parquet footer (row group statistics), without decoding the data. The
+        index column of Arrow IPC files is memory-mapped to compute its minimum and maximum.
+        """
+        stat = os.stat(file)
+
+        if file.endswith(".arrow"):
+            table = _open_arrow_file(file).read_all()
+            bounds = pyarrow.compute.min_max(table.column(_index_column(table.schema)))
+
+            return ManifestEntry(
+                rows=table.num_rows,
+                min_timestamp=(
+                    pd.Timestamp(bounds["min"].as_py()).value
+                    if table.num_rows
+                    else None
+                ),
+                max_timestamp=(
+                    pd.Timestamp(bounds["max"].as_py()).value
+                    if table.num_rows
+                    else None
+                ),
+                bytes=stat.st_size,
+                schema=_schema_hash(table.schema),
+                mtime_ns=stat.st_mtime_ns,
+            )
+
+        parquet_file = pq.ParquetFile(file)
+        metadata = parquet_file.metadata
+        schema = parquet_file.schema_arrow
+        index = schema.get_field_index(_index_column(schema))
+
+        minimums, maximums = [], []
+        for row_group in range(metadata.num_row_groups):
+            statistics = metadata.row_group(row_group).column(index).statistics
+            if statistics is None or not statistics.has_min_max:
+                # No statistics, fall back on reading the index column only
+                timestamps = pq.read_table(file, columns=[schema.field(index).name])
+                timestamps = timestamps.column(0).to_pandas()
+                minimums, maximums = [timestamps.min()], [timestamps.max()]
+                break
+            minimums.append(pd.Timestamp(statistics.min))
+            maximums.append(pd.Timestamp(statistics.max))
+
+        return ManifestEntry(
+            rows=metadata.num_rows,
+            min_timestamp=min(minimums).value if metadata.num_rows else None,
+            max_timestamp=max(maximums).value if metadata.num_rows else None,
+            bytes=stat.st_size,
+            schema=_schema_hash(schema),
+            mtime_ns=stat.st_mtime_ns,
+        )
+
+
+def _shard(file: str) -> Tuple[str, str]:
+    """
+    Get the directory of a data file and the date of its daily partition (named after the date, or in the date=<date>
+    directory of the hive layout), whose files share a manifest.
+    """
+    directory, name = os.path.split(file)
+    parent = os.path.basename(directory)
+
+    if parent.startswith("date="):
+        return directory, parent[len("date=") :]
+
+    return directory, name[:10]
+
+
+class Manifest:
+    """
+    A class for managing the manifests of the storage. Each daily partition has a manifest (_manifest.<date>.json, next
+    to its files) recording the row count, min/max timestamp, byte size and schema hash of each of its files, so these
+    can be answered without opening the data files. A store only rewrites the manifest of the day it writes to, whose
+    size does not grow with the history of the dataset.
+
+    The manifests are caches: entries whose size or mtime do not match the file anymore (or missing entries, e.g.
+    because two processes updated the manifest concurrently) are rebuilt from the parquet footer (or the Arrow IPC file) and saved again.
+
+    Methods:
+        record(file, df): Records the entry of a file that was just written.
+        remove(files): Removes the entries of deleted files, and the manifests left empty.
+        entries(files): Gets the (up-to-date) entries of a list of files of the same directory.
+    """
+
+    FILENAME = "_manifest.{date}.json"
+
+    def __init__(self):
+        # In-memory copy of the manifests: (directory, date) -> (mtime of the manifest, entries)
+        self._cache: Dict[Tuple[str, str], tuple] = {}
+
+    def _path(self, directory: str, date: str) -> str:
+        return os.path.join(directory, self.FILENAME.format(date=date))
+
+    def _load(self, directory: str, date: str) -> Dict[str, ManifestEntry]:
+        """Load the manifest of a partition, reusing the in-memory copy if the file did not change."""
+        path = self._path(directory, date)
+
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+
+        cached = self._cache.get((directory, date))
+        if cached and cached[0] == mtime_ns:
+            return cached[1]
+
+        try:
+            with open(path, "r") as file:
+                entries = {
+                    name: ManifestEntry(**entry)
+                    for name, entry in json.load(file).items()
+                }
+        except (ValueError, TypeError):
+            # Corrupted manifest, it is rebuilt from the files
+            entries = {}
+
+        self._cache[(directory, date)] = (mtime_ns, entries)
+
+        return entries
+
+    def _save(
+        self,
+        directory: str,
+        date: str,
+        updates: Dict[str, ManifestEntry],
+        removed=(),
+    ):
+        """
+        Merge updates into the latest version of the manifest of a partition and save it atomically (or remove it if no
+        entry is left).
+        """
+        entries = dict(self._load(directory, date))
+        entries.update(updates)
+        for name in removed:
+            entries.pop(name, None)
+
+        path = self._path(directory, date)
+
+        if not entries:
+            self._cache.pop((directory, date), None)
+
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+            return
+
+        tmp_path = os.path.join(
+            directory, f".{os.path.basename(path)}.{os.getpid()}.tmp"
+        )
+        with open(tmp_path, "w") as file:
+            json.dump({name: asdict(entry) for name, entry in entries.items()}, file)
+        os.replace(tmp_path, path)
+
+        self._cache[(directory, date)] = (os.stat(path).st_mtime_ns, entries)
+
+    def record(self, file: str, df: pd.DataFrame):
+        """Record the entry of a file that was just written from the given dataframe."""
+        self._save(
+            *_shard(file),
+            {os.path.basename(file): ManifestEntry.from_dataframe(file, df)},
+        )
+
+    def remove(self, files: List[str]):
+        """Remove the entries of files that were deleted."""
+        removed = {}
+
+        for file in files:
+            removed.setdefault(_shard(file), []).append(os.path.basename(file))
+
+        for (directory, date), names in removed.items():
+            self._save(directory, date, {}, names)
+
+    def entries(self, files: List[str]) -> Dict[str, ManifestEntry]:
+        """
+        Get the entries of a list of files, by file. Files that vanished in the meantime (e.g. merged by the
+        compaction) are skipped.
+        """
+        entries, updates = {}, {}
+
+        for file in files:
+            directory, date = _shard(file)
+            name = os.path.basename(file)
+            entry = self._load(directory, date).get(name)
+
+            try:
+                stat = os.stat(file)
+                if (
+                    entry is None
+                    or entry.bytes != stat.st_size
+                    or entry.mtime_ns != stat.st_mtime_ns
+                ):
+                    entry = ManifestEntry.from_file(file)
+                    updates.setdefault((directory, date), {})[name] = entry
+            except FileNotFoundError:
+                continue
+
+            entries[file] = entry
+
+        for (directory, date), shard_updates in updates.items():
+            self._save(directory, date, shard_updates)
+
+        return entries
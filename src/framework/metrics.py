@@ -0,0 +1,431 @@
+import glob
+import logging
+import multiprocessing.util
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple, Union
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+__all__ = ["enable_metrics", "merge_metrics", "serve_metrics"]
+
+logger = logging.getLogger(__name__)
+
+# The type and description of each metric
+_METRICS = {
+    "component_runs_total": ("counter", "Amount of runs of the components."),
+    "component_phase_seconds_total": (
+        "counter",
+        "Wall time spent in each phase of the runs (read, run, store), in seconds.",
+    ),
+    "component_rows_read_total": ("counter", "Rows read from the dependencies."),
+    "component_rows_written_total": ("counter", "Rows output by the components."),
+    "component_bytes_read_total": (
+        "counter",
+        "In-memory size (deep) of the dataframes read from the dependencies, in bytes.",
+    ),
+    "component_bytes_written_total": (
+        "counter",
+        "In-memory size (deep) of the dataframes output by the components, in bytes.",
+    ),
+    "component_peak_rss_bytes": (
+        "gauge",
+        "Peak resident set size of the process during the last run of the component, in bytes.",
+    ),
+    "component_run_memory_bytes": (
+        "gauge",
+        "Memory used by the last run of the component (its peak RSS above the RSS before the run), in bytes.",
+    ),
+    "component_batch_scale": (
+        "gauge",
+        "Factor applied to the batch sizes of the last run of the component, to stay below its max_memory.",
+    ),
+    "component_failed_runs_total": (
+        "counter",
+        "Runs of the components that raised an error.",
+    ),
+    "component_deferred_runs_total": (
+        "counter",
+        "Runs of the components with a max_memory deferred since the host did not have the memory they need available.",
+    ),
+    "component_checkpoint_timestamp_seconds": (
+        "gauge",
+        "Last timestamp processed by the components (their checkpoint), in seconds since the epoch.",
+    ),
+    "component_checkpoint_lag_seconds": (
+        "gauge",
+        "Time between now (when the metrics are read) and the last timestamp processed, in seconds.",
+    ),
+}
+
+# The metrics computed when the metrics are formatted, from the metric they are derived from
+_DERIVED_METRICS = {
+    "component_checkpoint_lag_seconds": "component_checkpoint_timestamp_seconds"
+}
+
+_SAMPLE_PATTERN = re.compile(r"^([a-z_]+)\{(.*)\} (\S+)$")
+
+# Minimum delay between two writes of the metrics file of a process, in seconds
+_FLUSH_INTERVAL = 1.0
+
+# The metrics of this process (None if disabled), see enable_metrics
+_metrics = None
+
+
+class _Metrics:
+    """
+    The metrics of a process, written as Prometheus text to a file named after the process (<pid>.prom) in the
+    metrics folder, at most once per _FLUSH_INTERVAL.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.values: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, name: str, value: float, labels: Dict[str, str]):
+        key = (name, tuple(sorted(labels.items())))
+
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name: str, value: float, labels: Dict[str, str]):
+        with self._lock:
+            self.values[(name, tuple(sorted(labels.items())))] = value
+
+    def flush(self, force: bool = False):
+        if not force and time.monotonic() - self._last_flush < _FLUSH_INTERVAL:
+            return
+
+        with self._lock:
+            text = _format(self.values)
+            self._last_flush = time.monotonic()
+
+        file = os.path.join(self.path, f"{os.getpid()}.prom")
+        tmp_file = f"{file}.tmp"
+
+        with open(tmp_file, "w") as stream:
+            stream.write(text)
+        os.replace(tmp_file, file)
+
+
+def _format(values: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float]) -> str:
+    """Format metric values as Prometheus text, computing the derived metrics (e.g. the checkpoint lag) as of now."""
+    lines = []
+    now = pd.Timestamp.now().timestamp()
+    values = {
+        **values,
+        **{
+            (derived, labels): now - value
+            for derived, source in _DERIVED_METRICS.items()
+            for (key, labels), value in values.items()
+            if key == source
+        },
+    }
+
+    for name, (kind, description) in _METRICS.items():
+        samples = sorted(
+            (labels, value) for (key, labels), value in values.items() if key == name
+        )
+
+        if not samples:
+            continue
+
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+
+        for labels, value in samples:
+            formatted = ",".join(
+                f'{label}="{_escape(label_value)}"' for label, label_value in labels
+            )
+            lines.append(f"{name}{{{formatted}}} {float(value)!r}")
+
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def enable_metrics(path: str, reset: bool = False):
+    """
+    Enable the metrics of this process, written to the given folder. Processes started afterwards (forked) inherit
+    them, spawned processes must enable them as well.
+
+    :param path: The folder of the metrics files, one per process
+    :param reset: Whether to remove the metrics files of previous runs
+    """
+    global _metrics
+
+    os.makedirs(path, exist_ok=True)
+
+    if reset:
+        for file in glob.glob(os.path.join(path, "*.prom")):
+            os.remove(file)
+
+    if _metrics is None or _metrics.path != path:
+        _metrics = _Metrics(path)
+        _register_flush_on_exit()
+
+
+def _register_flush_on_exit():
+    # The children of multiprocessing exit without running the atexit handlers, but they run the finalizers
+    multiprocessing.util.Finalize(None, _flush_on_exit, exitpriority=10)
+
+
+def _flush_on_exit():
+    if _metrics is not None and _metrics.values:
+        _metrics.flush(force=True)
+
+
+def _after_fork(_):
+    # A forked process starts with its own (empty) metrics, the parent reports its own values. The finalizers of the
+    # parent are not inherited.
+    if _metrics is not None:
+        _metrics.values = {}
+        _metrics._lock = threading.Lock()
+        _metrics._last_flush = 0.0
+        _register_flush_on_exit()
+
+
+multiprocessing.util.register_after_fork(_after_fork, _after_fork)
+
+
+def _labels(component: str, train_id) -> Dict[str, str]:
+    return {
+        "component": component,
+        "train_id": "" if train_id is None else str(train_id),
+    }
+
+
+def record_phase(component: str, train_id, phase: str, seconds: float):
+    """Record the wall time of a phase (read, run or store) of a run of a component."""
+    if _metrics is not None:
+        _metrics.add(
+            "component_phase_seconds_total",
+            seconds,
+            {**_labels(component, train_id), "phase": phase},
+        )
+
+
+def record_run(component: str, train_id):
+    """Record a run of a component."""
+    if _metrics is not None:
+        _metrics.add("component_runs_total", 1, _labels(component, train_id))
+
+
+def record_volume(component: str, train_id, direction: str, rows: int, size: int):
+    """Record rows and bytes read (direction read) or output (direction written) by a component."""
+    if _metrics is not None:
+        labels = _labels(component, train_id)
+        _metrics.add(f"component_rows_{direction}_total", rows, labels)
+        _metrics.add(f"component_bytes_{direction}_total", size, labels)
+
+
+def record_frame(component: str, train_id, direction: str, df: pd.DataFrame):
+    """Record the rows and bytes of a dataframe read or output by a component (see record_volume)."""
+    if _metrics is not None and isinstance(df, pd.DataFrame):
+        record_volume(component, train_id, direction, len(df), memory_usage(df))
+
+
+def record_memory(component: str, train_id, peak: int, used: int, scale: float):
+    """Record the peak RSS and the memory used by a run of a component, and the factor applied to its batch sizes."""
+    if _metrics is not None:
+        labels = _labels(component, train_id)
+        _metrics.set("component_peak_rss_bytes", peak, labels)
+        _metrics.set("component_run_memory_bytes", used, labels)
+        _metrics.set("component_batch_scale", scale, labels)
+
+
+def record_failure(component: str, train_id):
+    """Record a run of a component that raised an error."""
+    if _metrics is not None:
+        _metrics.add("component_failed_runs_total", 1, _labels(component, train_id))
+
+
+def record_deferred(component: str, train_id):
+    """Record a run of a component deferred by its max_memory."""
+    if _metrics is not None:
+        _metrics.add("component_deferred_runs_total", 1, _labels(component, train_id))
+
+
+def memory_usage(df: pd.DataFrame) -> int:
+    """Get the in-memory size of a dataframe, including the contents of its object columns (e.g. strings), in bytes."""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def _status_bytes(field: str) -> int:
+    """Get a memory field of /proc/self/status (Linux), in bytes. 0 if it is not available."""
+    try:
+        with open("/proc/self/status", "r") as status:
+            for line in status:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return 0
+
+
+def available_memory() -> int:
+    """Get the memory available on the host for new allocations (MemAvailable, Linux), in bytes (0 if not available)."""
+    try:
+        with open("/proc/meminfo", "r") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return 0
+
+
+def current_rss() -> int:
+    """Get the resident set size of this process, in bytes (0 if it is not available)."""
+    return _status_bytes("VmRSS")
+
+
+def reset_peak_rss():
+    """Reset the peak RSS of this process to its current RSS, so peak_rss covers what follows (Linux only)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss() -> int:
+    """
+    Get the peak resident set size of this process since reset_peak_rss, in bytes. Without /proc, the peak since the
+    start of the process is returned instead.
+    """
+    peak = _status_bytes("VmHWM")
+
+    if not peak and resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # The peak is in kilobytes on Linux, in bytes on macOS
+        peak = peak if sys.platform == "darwin" else peak * 1024
+
+    return peak
+
+
+def record_checkpoint(component: str, train_id, timestamp: pd.Timestamp):
+    """
+    Record the last timestamp a component processed, when it registers it. Its lag behind now is computed when the
+    metrics are read, so the lag of a stalled component keeps growing.
+    """
+    if _metrics is not None and not pd.isna(timestamp):
+        _metrics.set(
+            "component_checkpoint_timestamp_seconds",
+            pd.Timestamp(timestamp).timestamp(),
+            _labels(component, train_id),
+        )
+
+
+def flush_metrics():
+    """Write the metrics of this process to its file, unless they were written less than _FLUSH_INTERVAL ago."""
+    if _metrics is not None:
+        _metrics.flush()
+
+
+def merge_metrics(path: str) -> str:
+    """
+    Merge the metrics files of the processes in a folder into a single Prometheus text. The counters are summed over
+    the processes, the gauges are taken from the most recently written file, and the checkpoint lag is computed from the
+    checkpoint timestamps as of now.
+
+    :param path: The folder of the metrics files
+    :return: The metrics, as Prometheus text
+    """
+    values = {}
+    files = sorted(glob.glob(os.path.join(path, "*.prom")), key=_modification_time)
+
+    for file in files:
+        try:
+            with open(file, "r") as stream:
+                lines = stream.read().splitlines()
+        except FileNotFoundError:
+            continue
+
+        for line in lines:
+            match = _SAMPLE_PATTERN.match(line)
+
+            # The derived metrics are computed again, as of now
+            if (
+                not match
+                or match.group(1) not in _METRICS
+                or match.group(1) in _DERIVED_METRICS
+            ):
+                continue
+
+            name, labels, value = match.groups()
+            key = (name, tuple(re.findall(r'([a-z_]+)="((?:[^"\\]|\\.)*)"', labels)))
+
+            if _METRICS[name][0] == "counter":
+                values[key] = values.get(key, 0) + float(value)
+            else:
+                values[key] = float(value)
+
+    # The label values are already escaped
+    return _format(
+        {
+            (name, tuple((label, _unescape(value)) for label, value in labels)): value
+            for (name, labels), value in values.items()
+        }
+    )
+
+
+def _unescape(value: str) -> str:
+    return re.sub(
+        r"\\(.)", lambda match: "\n" if match.group(1) == "n" else match.group(1), value
+    )
+
+
+def _modification_time(file: str) -> Union[float, int]:
+    try:
+        return os.path.getmtime(file)
+    except FileNotFoundError:
+        return 0
+
+
+def serve_metrics(path: str, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serve the merged metrics of the processes (see merge_metrics) as Prometheus text on http://<host>:<port>/metrics,
+    from a daemon thread.
+
+    :param path: The folder of the metrics files
+    :param port: The port of the HTTP server
+    :param host: The address of the HTTP server (default: 127.0.0.1, only local)
+    :return: The HTTP server
+    """
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+
+            body = merge_metrics(path).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
@@ -0,0 +1,79 @@
+import multiprocessing
+import queue
+from typing import Dict, Iterable, List, NamedTuple, Union
+
+import pandas as pd
+
+__all__ = ["Notification", "Notifier"]
+
+
+class Notification(NamedTuple):
+    """A notification that data was stored in a dataset, for a train (None for data not related to a train)."""
+
+    name: str
+    train_id: Union[str, None]
+    last_timestamp: pd.Timestamp
+
+
+class Notifier:
+    """
+    Publishes the stores of the datasets to the processes depending on them, through multiprocessing queues. The
+    subscriptions must be made before the processes are started, so the queues are inherited by the processes.
+
+    Attributes:
+        subscriptions (dict): The queues subscribed to each dataset, by name.
+        published (list): Optional, the notifications published by this process, if they are recorded (e.g. returned
+            by the tasks of a pool to the scheduler).
+
+    Methods:
+        subscribe(names): Creates a queue receiving the notifications of the given datasets.
+        publish(name, train_id, last_timestamp): Notifies the subscribers of a dataset that data was stored.
+        wait(notifications, timeout): Waits for notifications, then gets all the notifications already queued.
+    """
+
+    def __init__(self, record: bool = False):
+        self.subscriptions: Dict[str, List[multiprocessing.Queue]] = {}
+        self.published: Union[List[Notification], None] = [] if record else None
+
+    def subscribe(self, names: Iterable[str]) -> multiprocessing.Queue:
+        """Create a queue receiving the notifications of the given datasets."""
+        notifications = multiprocessing.Queue()
+
+        for name in set(names):
+            self.subscriptions.setdefault(name, []).append(notifications)
+
+        return notifications
+
+    def publish(
+        self, name: str, train_id: Union[str, None], last_timestamp: pd.Timestamp
+    ):
+        """Notify the subscribers of a dataset that data was stored, up to the given timestamp."""
+        notification = Notification(name, train_id, last_timestamp)
+
+        if self.published is not None:
+            self.published.append(notification)
+
+        for notifications in self.subscriptions.get(name, []):
+            notifications.put(notification)
+
+    @staticmethod
+    def wait(
+        notifications: multiprocessing.Queue, timeout: float = None
+    ) -> List[Notification]:
+        """
+        Wait for notifications (at most timeout seconds, None to wait forever, 0 to not wait), then get all the
+        notifications already queued, so a burst of stores is handled at once. Empty if no notification arrived in time.
+        """
+        received = []
+
+        try:
+            received.append(
+                notifications.get(block=timeout != 0, timeout=timeout or None)
+            )
+
+            while True:
+                received.append(notifications.get_nowait())
+        except queue.Empty:
+            pass
+
+        return received
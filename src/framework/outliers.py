@@ -2,6 +2,7 @@ from datetime import datetime
 from typing import List
 
 import pandas as pd
+from pandas.tseries.frequencies import to_offset
 
 from src.framework import Period, StorageManager
 
@@ -69,6 +70,48 @@ def compute_ranking_for_train_for_outliers(
     return ranking[["intensity"]]
 
 
+def compute_ranking_for_train_from_rollup(
+    rollup: pd.DataFrame,
+    intensity_column: str = None,
+    intensity_mode: str = "multiplicative",
+):
+    """
+    Compute the ranking for all trains from the rollup of their outliers (see StorageManager.get_rollup), giving the
+    same ranking as compute_ranking_for_train_for_outliers on the outliers of the buckets of the rollup (only whole
+    buckets are counted, see _get_ranking_from_rollup for periods not aligned on the buckets). The intensity column must
+    be a numeric column, which the rollup holds the sum and count of.
+    :param rollup: The rollup of the outliers for all trains.
+    :param intensity_column: (Optional) The column to use for the intensity.
+    :param intensity_mode: The mode to use for the intensity. Supported values: multiplicative, additive, exponential.
+    :return: A DataFrame containing the ranking for all trains.
+    """
+    if "train_id" not in rollup.columns:
+        print("No train_id column in data")
+        return None
+
+    # The intensity of each outlier is its value (multiplied or raised to 1), or its value plus 1 (additive)
+    if intensity_column is None:
+        intensity = rollup["rows"]
+    elif intensity_mode in ("multiplicative", "exponential"):
+        intensity = rollup[f"{intensity_column}_sum"]
+    elif intensity_mode == "additive":
+        intensity = (
+            rollup[f"{intensity_column}_sum"] + rollup[f"{intensity_column}_count"]
+        )
+    else:
+        raise ValueError("Intensity mode not supported")
+
+    # Compute the ranking
+    ranking = (
+        intensity.groupby(rollup["train_id"])
+        .sum()
+        .to_frame("intensity")
+        .sort_values(ascending=False, by="intensity")
+    )
+
+    return ranking[["intensity"]]
+
+
 def compute_ranking_for_train_for_outliers_degressive(
     data: pd.DataFrame,
     intensity_column: str = None,
@@ -158,6 +201,18 @@ def get_ranking_for_components(
         if period is None:
             period = _get_last_30_days(component.name, storage_manager)
 
+        frequencies = storage_manager.rollup_frequencies(component.name)
+
+        if frequencies and not decay:
+            # The coarsest rollup holds the fewest rows
+            frequency = max(
+                frequencies, key=lambda value: pd.Timedelta(to_offset(value))
+            )
+            rankings.append(
+                _get_ranking_from_rollup(component, storage_manager, frequency, period)
+            )
+            continue
+
         args = dict(
             data=storage_manager.get_for_all_trains(component.name, period),
             intensity_column=component.intensity_column,
@@ -176,6 +231,96 @@ def get_ranking_for_components(
     return combined_ranking
 
 
+def _get_ranking_from_rollup(
+    component, storage_manager: StorageManager, frequency: str, period: Period = None
+):
+    """
+    Compute the ranking of the outliers of a component within a period from its rollup at a frequency, giving the same
+    ranking as compute_ranking_for_train_for_outliers on the raw outliers of the period. The buckets within the period
+    are read from the rollup, the outliers of the partial buckets at the edges of the period are read raw. If the
+    intensity column is not rolled up (e.g. a boolean column), all the outliers of the period are read raw.
+    :param component: The component.
+    :param storage_manager: The storage manager.
+    :param frequency: The frequency of the rollup.
+    :param period: (Optional) The period, all the outliers by default.
+    :return: A DataFrame containing the ranking for all trains.
+    """
+    start, end = period or (None, None)
+    # The periods include their bounds, the buckets do not include their end
+    precision = pd.Timedelta(microseconds=1)
+
+    inner_start = start.ceil(frequency) if start is not None else None
+    inner_end = (end + precision).floor(frequency) if end is not None else None
+
+    if inner_start is not None and inner_end is not None and inner_start >= inner_end:
+        # The period is within a single bucket
+        return compute_ranking_for_train_for_outliers(
+            data=storage_manager.get_for_all_trains(component.name, period),
+            intensity_column=component.intensity_column,
+            intensity_mode="multiplicative",
+        )
+
+    rollup = storage_manager.get_rollup(
+        component.name,
+        frequency,
+        period=(
+            inner_start,
+            inner_end - precision if inner_end is not None else None,
+        ),
+    )
+    intensity_column = component.intensity_column
+
+    if intensity_column is not None and not {
+        f"{intensity_column}_sum",
+        f"{intensity_column}_count",
+    }.issubset(rollup.columns):
+        # Only the numeric columns are rolled up, the ranking is computed from the raw outliers of the period instead
+        return compute_ranking_for_train_for_outliers(
+            data=storage_manager.get_for_all_trains(component.name, period),
+            intensity_column=intensity_column,
+            intensity_mode="multiplicative",
+        )
+
+    rankings = [
+        compute_ranking_for_train_from_rollup(
+            rollup,
+            intensity_column=intensity_column,
+            intensity_mode="multiplicative",
+        )
+    ]
+
+    edges = []
+
+    if start is not None and start < inner_start:
+        edges.append((start, inner_start - precision))
+    if end is not None and inner_end <= end:
+        edges.append((inner_end, end))
+
+    for edge in edges:
+        data = storage_manager.get_for_all_trains(component.name, edge)
+
+        if not data.empty:
+            rankings.append(
+                compute_ranking_for_train_for_outliers(
+                    data=data,
+                    intensity_column=component.intensity_column,
+                    intensity_mode="multiplicative",
+                )
+            )
+
+    rankings = [ranking for ranking in rankings if ranking is not None]
+
+    if not rankings:
+        return None
+
+    return (
+        pd.concat(rankings)
+        .groupby(level=0)
+        .sum()
+        .sort_values(ascending=False, by="intensity")
+    )
+
+
 def _get_last_30_days(component_name, storage_manager):
     try:
         end_timestamp = max(
@@ -196,8 +341,40 @@ def get_outliers_for_train(
     component: str,
     storage_manager: StorageManager,
     period: Period = None,
+    columns: List[str] = None,
 ):
     if period is None:
         period = _get_last_30_days(component, storage_manager)
 
-    return storage_manager.get_for_train(component,train_id, period)
+    return storage_manager.get_for_train(component, train_id, period, columns=columns)
+
+
+def get_hourly_outliers_count_for_train(
+    train_id: str,
+    component: str,
+    storage_manager: StorageManager,
+    period: Period = None,
+):
+    """
+    Get the amount of outliers of a train per hour from the hourly rollup of the component, or None if the component
+    does not maintain an hourly rollup.
+    :param train_id: The train.
+    :param component: The component.
+    :param storage_manager: The storage manager.
+    :param period: (Optional) The period, the last 30 days by default.
+    :return: A Series containing the amount of outliers per hour.
+    """
+    frequencies = storage_manager.rollup_frequencies(component)
+
+    if not any(to_offset(value) == to_offset("1h") for value in frequencies):
+        return None
+
+    if period is None:
+        period = _get_last_30_days(component, storage_manager)
+
+    rollup = storage_manager.get_rollup(component, "1h", train_id, period)
+
+    if rollup.empty:
+        return pd.Series(dtype=int)
+
+    return rollup.groupby(level=0)["rows"].sum()
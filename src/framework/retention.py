@@ -0,0 +1,265 @@
+import contextlib
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Union
+
+import pandas as pd
+import pyarrow
+import pyarrow.parquet as pq
+
+from src.framework.config import (
+    Config,
+    ConfigComponent,
+    load_config_from_file,
+    RetentionPolicy,
+)
+from src.framework.manifest import Manifest
+from src.framework.runner_persistence import RunnerPersistence
+from src.framework.storage import (
+    StorageManager,
+    _merge_partition,
+    _partition_location,
+)
+
+__all__ = ["apply_retention", "run_retention"]
+
+logger = logging.getLogger(__name__)
+
+# Key of the parquet metadata recording the frequency a partition was downsampled to
+_DOWNSAMPLED_KEY = "downsampled"
+
+
+def _downsample(df: pd.DataFrame, frequency: str) -> pd.DataFrame:
+    """
+    Downsample rows into buckets of the given frequency, indexed by the start of the bucket. Numeric columns are
+    averaged (integer columns are rounded, so the schema of the dataset does not change), the other columns keep their
+    last value.
+    """
+    numeric = df.select_dtypes("number").columns
+    downsampled = df.groupby(df.index.floor(frequency)).agg(
+        {column: "mean" if column in numeric else "last" for column in df.columns}
+    )
+
+    for column in numeric:
+        if pd.api.types.is_integer_dtype(df[column].dtype):
+            downsampled[column] = downsampled[column].round().astype(df[column].dtype)
+
+    return downsampled
+
+
+def _downsampled_frequency(files: List[str]) -> Union[str, None]:
+    """
+    Get the frequency a partition was downsampled to, from the metadata of its base file. None if the partition holds
+    raw data (or deltas were written since it was downsampled).
+    """
+    if len(files) != 1 or not files[0].endswith(".parquet"):
+        return None
+
+    value = (pq.read_schema(files[0]).metadata or {}).get(_DOWNSAMPLED_KEY.encode())
+
+    return value.decode() if value else None
+
+
+def _delete_partition(files: List[str], manifest: Manifest):
+    """Delete the files of a daily partition, and its date directory in the hive layout."""
+    for file in files:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(file)
+
+    # The manifest of the partition is removed with its last entry
+    manifest.remove(files)
+
+    directory = os.path.dirname(files[0])
+
+    if os.path.basename(directory).startswith("date="):
+        # The directory is only removed if no file was written to it in the meantime
+        with contextlib.suppress(OSError):
+            os.rmdir(directory)
+
+
+def _consumed_until(
+    storage_manager: StorageManager,
+    runner_persistence: RunnerPersistence,
+    consumers: List[ConfigComponent],
+    directory: str,
+) -> Union[datetime, None]:
+    """
+    Get the minimum checkpoint of the components reading a dataset, for the train of one of its directories (all the
+    trains for data not related to a train). None if one of them never ran, nothing of the dataset was consumed then.
+    """
+    train_id = os.path.basename(directory).removeprefix("train_id=")
+    dataset_directory = os.path.dirname(directory)
+
+    if os.path.normpath(os.path.dirname(dataset_directory)) != os.path.normpath(
+        storage_manager.path
+    ):
+        # The directory is the dataset itself (data not related to a train)
+        train_id = None
+
+    checkpoints = []
+
+    for consumer in consumers:
+        if not consumer.run_per_train:
+            train_ids = [None]
+        elif train_id is None:
+            train_ids = storage_manager.retrieve_train_ids()
+        else:
+            train_ids = [train_id]
+
+        for _train_id in train_ids:
+            if not runner_persistence.get_did_run(consumer.name, _train_id):
+                return None
+
+            checkpoints.append(
+                runner_persistence.get_last_timestamp(consumer.name, _train_id)
+            )
+
+    return min(checkpoints, default=datetime.max)
+
+
+def apply_retention(
+    storage_manager: StorageManager,
+    policies: Dict[str, RetentionPolicy],
+    runner_persistence: RunnerPersistence = None,
+    consumers: Dict[str, List[ConfigComponent]] = None,
+):
+    """
+    Apply the retention policies of the datasets to their daily partitions. The age of a partition is the amount of
+    days between its date and the latest date of its directory (of its train), so replaying historical data does not
+    delete it at once.
+
+    With the runner persistence, the age is counted from the minimum checkpoint of the components reading the dataset
+    instead, if it is older: the data they did not process yet (and the raw_days before it, read by their before
+    dependencies) is never downsampled nor deleted, so their outputs do not depend on when the retention ran.
+
+    Partitions at least raw_days old are downsampled to the downsample frequency, or deleted if the policy does not
+    downsample. Partitions at least delete_after_days old are deleted. Downsampled partitions are marked in their
+    parquet metadata, so they are not downsampled again.
+
+    :param storage_manager: The storage manager whose datasets are cleaned
+    :param policies: The retention policy of each dataset, by name
+    :param runner_persistence: Optional, the checkpoints of the components reading the datasets
+    :param consumers: The components reading each dataset, by name (required with the runner persistence)
+    """
+    for name, policy in policies.items():
+        for directory, _, _ in os.walk(os.path.join(storage_manager.path, name)):
+            partitions = storage_manager._list_partitions(directory)
+
+            if not partitions:
+                continue
+
+            latest = datetime.strptime(
+                _partition_location(partitions[-1][0])[1], "%Y-%m-%d"
+            )
+
+            if runner_persistence is not None:
+                consumed = _consumed_until(
+                    storage_manager,
+                    runner_persistence,
+                    consumers.get(name, []),
+                    directory,
+                )
+
+                if consumed is None:
+                    continue
+
+                latest = min(
+                    latest, datetime.combine(consumed.date(), datetime.min.time())
+                )
+
+            for files in partitions:
+                date = _partition_location(files[0])[1]
+                age = (latest - datetime.strptime(date, "%Y-%m-%d")).days
+
+                try:
+                    if (
+                        policy.delete_after_days is not None
+                        and age >= policy.delete_after_days
+                    ) or (
+                        policy.raw_days is not None
+                        and age >= policy.raw_days
+                        and not policy.downsample
+                    ):
+                        _delete_partition(files, storage_manager._manifest)
+                        logger.debug("Deleted partition %s", files[0])
+                    elif (
+                        policy.raw_days is not None
+                        and age >= policy.raw_days
+                        and _downsampled_frequency(files) != policy.downsample
+                    ):
+                        _merge_partition(
+                            files,
+                            ".parquet",
+                            storage_manager.dataset_options.get(name),
+                            manifest=storage_manager._manifest,
+                            transform=lambda df: _downsample(df, policy.downsample),
+                            metadata={_DOWNSAMPLED_KEY: policy.downsample},
+                        )
+                        logger.debug(
+                            "Downsampled partition %s to %s",
+                            files[0],
+                            policy.downsample,
+                        )
+                except (pyarrow.lib.ArrowInvalid, OSError) as error:
+                    logger.warning(
+                        "Could not apply the retention to partition %s: %s",
+                        files[0],
+                        error,
+                    )
+
+
+def _retention_policies(config: Config) -> Dict[str, RetentionPolicy]:
+    """Get the retention policies of the components of the configuration, by name."""
+    return {
+        name: component.retention
+        for name, component in config.components.items()
+        if component.retention
+    }
+
+
+def _consumers(config: Config) -> Dict[str, List[ConfigComponent]]:
+    """Get the components reading each dataset of the configuration, by name."""
+    consumers = {}
+
+    for component in config.components.values():
+        for dependency in component.dependencies:
+            consumers.setdefault(dependency.component, [])
+
+            if component not in consumers[dependency.component]:
+                consumers[dependency.component].append(component)
+
+    return consumers
+
+
+def _run_retention_for_ever(
+    storage_manager: StorageManager,
+    policies: Dict[str, RetentionPolicy],
+    interval: float,
+    runner_persistence: RunnerPersistence = None,
+    consumers: Dict[str, List[ConfigComponent]] = None,
+):
+    """Apply the retention policies forever, waiting for the given interval (in seconds) between two passes."""
+    while True:
+        apply_retention(storage_manager, policies, runner_persistence, consumers)
+        time.sleep(interval)
+
+
+def run_retention(config_path: str = "config.toml"):
+    """
+    Run the retention service forever, it can be run next to the pipeline (see the retention settings of the
+    components in the configuration file).
+
+    :param config_path: The path to the configuration file (default: config.toml)
+    :return: None
+    """
+    config = load_config_from_file(config_path)
+
+    _run_retention_for_ever(
+        StorageManager.from_config(config),
+        _retention_policies(config),
+        config.retention_interval,
+        RunnerPersistence(config.runner_persistence),
+        _consumers(config),
+    )
@@ -1,16 +1,71 @@
+import gc
+import heapq
+import itertools
 import logging
 import multiprocessing
+import multiprocessing.util
+import os
 import time
-from typing import Union
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Set, Tuple, Union
 
 import pandas as pd
 
-from src.framework.config import ConfigComponent, load_config_from_file
+from src.framework.compaction import _run_compaction_for_ever
+from src.framework.component import Component
+from src.framework.config import (
+    ConfigComponent,
+    ConfigDependency,
+    load_config_from_file,
+)
+from src.framework.metrics import (
+    available_memory,
+    current_rss,
+    enable_metrics,
+    flush_metrics,
+    memory_usage,
+    peak_rss,
+    record_checkpoint,
+    record_deferred,
+    record_failure,
+    record_frame,
+    record_memory,
+    record_phase,
+    record_run,
+    record_volume,
+    reset_peak_rss,
+    serve_metrics,
+)
+from src.framework.notifications import Notification, Notifier
 from src.framework.period import build_period_from_frequency
+from src.framework.retention import (
+    _consumers,
+    _retention_policies,
+    _run_retention_for_ever,
+)
 from src.framework.runner_persistence import RunnerPersistence
 from src.framework.storage import StorageManager
+from src.framework.tracing import enable_tracing, span, trace_interval, trace_start
 
-__all__ = ["run_pipeline"]
+__all__ = ["Scheduler", "run_pipeline"]
+
+logger = logging.getLogger(__name__)
+
+_SCHEDULERS = ("dag", "processes")
+
+# Delay before a component without dependencies (e.g. the source) is polled again
+_POLL_INTERVAL = 0.1
+
+# The state of a process of a pool of the runner, set by _initialize_worker
+_worker_state = {}
+
+# The instances of the components in this process, by component name and train
+_instances: Dict[Tuple[str, Union[str, None]], Component] = {}
+
+# The memory used per row read by the last run of the components with a max_memory in this process, by name and train
+_bytes_per_row: Dict[Tuple[str, Union[str, None]], float] = {}
 
 
 def _instantiate_component_from_config(component: ConfigComponent):
@@ -25,14 +80,83 @@ def _instantiate_component_from_config(component: ConfigComponent):
     return instance
 
 
+def _get_component_instance(
+    component: ConfigComponent, train_id: str = None
+) -> Component:
+    """
+    Get the instance of a component for a train (None if the component does not run per train). It is instantiated and
+    set up on its first run in this process, then kept for the next runs.
+    """
+    key = (component.name, train_id)
+
+    if key not in _instances:
+        if not _instances:
+            # The children of multiprocessing exit without running the atexit handlers, but they run the finalizers
+            multiprocessing.util.Finalize(None, _teardown_instances, exitpriority=10)
+
+        instance = _instantiate_component_from_config(component)
+        instance.setup()
+        _instances[key] = instance
+
+    return _instances[key]
+
+
+def _teardown_instances():
+    """Tear down the instances of the components in this process."""
+    for (name, train_id), instance in _instances.items():
+        try:
+            instance.teardown()
+        except Exception as error:
+            logger.error(
+                "Could not tear down component %s for train %s",
+                name,
+                train_id,
+                exc_info=error,
+            )
+
+    _instances.clear()
+
+
+class _TrackedStream:
+    """
+    Wrap the stream of a streamed dependency, keeping track of the last timestamp yielded to the component, which is
+    only known once the component consumed the stream.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.last_timestamp = None
+        self.rows = 0
+        self.bytes = 0
+
+    def __iter__(self):
+        for df in self.stream:
+            if not df.empty:
+                self.last_timestamp = df.index.max()
+            self.rows += len(df)
+            self.bytes += memory_usage(df)
+            yield df
+
+
 def _component_should_run(
-    dependency, get_name, is_before, period, storage_manager, train_id
+    dependency,
+    get_name,
+    is_before,
+    period,
+    storage_manager,
+    train_id,
+    runner_persistence,
+    component_name,
 ):
     """
     Check if the component should run, depending on the dependency. If the dependency is before, then the component
     skips the dependency (since past data is not required by definition). Otherwise, the component checks if the
     dependency has sufficient data. If the dependency has sufficient data, then the component should run. Otherwise,
     the component should not run.
+
+    The rows stored since the last run of the component are read from its backlog, kept by the runner persistence,
+    only the trains whose backlog is not kept yet are counted in the storage. (The periods of the dependencies by
+    frequency do not start at the last run, their rows are always counted.)
     """
     if is_before:
         return True
@@ -40,24 +164,84 @@ def _component_should_run(
     start_timestamp = period[1] if dependency.frequency else period[0]
 
     if not train_id and dependency.get_component.per_train:
-        for _train_id in storage_manager.retrieve_train_ids():
-            if storage_manager.has_sufficient_data_since(
-                start_timestamp,
-                dependency.batch_size,
-                get_name,
-                _train_id,
-            ):
-                return True
-        return False
-    elif not storage_manager.has_sufficient_data_since(
-        start_timestamp,
-        dependency.batch_size,
-        get_name,
-        train_id,
-    ):
-        return False
+        train_ids = storage_manager.retrieve_train_ids()
+    else:
+        train_ids = [train_id]
+
+    if dependency.frequency:
+        return any(
+            storage_manager.has_sufficient_data_since(
+                start_timestamp, dependency.batch_size, get_name, _train_id
+            )
+            for _train_id in train_ids
+        )
+
+    backlog = runner_persistence.get_backlog(component_name, get_name, train_ids)
+    uncounted = [_train_id for _train_id, rows in backlog.items() if rows is None]
+
+    if uncounted:
+        # The stores made while counting are added to the backlog as well: rows may be counted twice, never missed
+        runner_persistence.open_backlog(component_name, get_name, uncounted)
+        runner_persistence.increment_backlog(
+            get_name,
+            {
+                _train_id: storage_manager.count_rows_since(
+                    start_timestamp, get_name, _train_id
+                )
+                for _train_id in uncounted
+            },
+            component_name,
+        )
+        backlog.update(
+            runner_persistence.get_backlog(component_name, get_name, uncounted)
+        )
+
+    return any(rows >= (dependency.batch_size or 0) for rows in backlog.values())
 
-    return True
+
+def _is_batched(dependency: ConfigDependency) -> bool:
+    """
+    Check if a dependency is read in batches of batch_size rows, which max_memory shrinks. The periods of the
+    dependencies before or by frequency are never shrunk, since it would change the data the component sees.
+    """
+    return (
+        bool(dependency.batch_size)
+        and not dependency.before
+        and not dependency.frequency
+    )
+
+
+def _batch_scale(component: ConfigComponent, train_id: str = None) -> float:
+    """
+    Get the factor to apply to the batch sizes of a component (see _is_batched), so the memory of its run stays below
+    its max_memory: the memory its last run used per row read (its peak RSS above the RSS before the run, so the other
+    components and the caches of the process do not count), times the rows of its batches. 0 if the host does not have
+    the memory the run needs available (after a garbage collection), the run is then deferred.
+    """
+    if not component.max_memory:
+        return 1
+
+    bytes_per_row = _bytes_per_row.get((component.name, train_id))
+    rows = sum(
+        dependency.batch_size
+        for dependency in component.dependencies
+        if _is_batched(dependency)
+    )
+
+    if not bytes_per_row or not rows:
+        return 1
+
+    scale = min(1, component.max_memory / (bytes_per_row * rows))
+    needed = bytes_per_row * rows * scale
+
+    if available_memory() < needed:
+        gc.collect()
+
+        # The available memory is 0 if it is not known
+        if 0 < available_memory() < needed:
+            return 0
+
+    return scale
 
 
 def _run_component_once(
@@ -65,7 +249,7 @@ def _run_component_once(
     runner_persistence: RunnerPersistence,
     component: ConfigComponent,
     train_id: str = None,
-):
+) -> bool:
     """
     Run a component once. The caller is responsible for specifying whether the component should run for all trains or
     for a specific train (this behaviour is defined in the component configuration).
@@ -77,25 +261,49 @@ def _run_component_once(
     maximum timestamp of the period is used instead of the last timestamp of the values.
 
     The component will run if at least one dependency is not before. Otherwise, the system will raise an assertion error.
+    The dependencies are only read once all of them have sufficient data.
 
     :param storage_manager:
     :param runner_persistence:
     :param component:
     :param train_id:
-    :return:
+    :return: Whether the component ran and moved its last timestamp forward, so more data may be left to process
     """
     should_run = True
+    advanced = False
 
     data = {}
     max_timestamps = []
+    streams = []
 
     # Check if at least one dependency is not before (if no dependency, then it is not before)
     has_one_not_before = len(component.dependencies) == 0
 
+    # A component with a max_memory reads smaller batches to stay below it, and defers its run when the host lacks memory
+    scale = _batch_scale(component, train_id)
+
+    if not scale:
+        logger.warning(
+            "Deferring component %s for train %s, the host does not have the memory its run needs available",
+            component.name,
+            train_id,
+        )
+        record_deferred(component.name, train_id)
+        return advanced
+
+    rss_before = current_rss()
+    reset_peak_rss()
+
+    # The read phase covers the checks of the dependencies and the reads of their data (streams are read while running)
+    read_start = time.perf_counter()
+
     starting_timestamp = _get_starting_timestamp_for_all_dependencies(
         component, runner_persistence, storage_manager, train_id
     )
 
+    # The periods and limits of the reads of the dependencies, by dependency name
+    reads = {}
+
     # For each dependency, check if the component should run
     for dependency in component.dependencies:
         has_one_not_before = has_one_not_before or not dependency.before
@@ -114,7 +322,9 @@ def _run_component_once(
         else:
             period = (last_timestamp + pd.Timedelta(seconds=1), pd.Timestamp.now())
 
-        if dependency.batch_size:
+        if _is_batched(dependency):
+            limit = max(1, int(dependency.batch_size * scale))
+        elif dependency.batch_size:
             limit = dependency.batch_size
 
         if dependency.frequency:
@@ -122,59 +332,371 @@ def _run_component_once(
                 dependency.frequency, last_timestamp, is_before
             )
 
+        reads[dependency.name] = (period, limit)
+
+        # Once a dependency does not have sufficient data, the other dependencies are not checked
+        if not should_run:
+            continue
+
+        # Check if the component should run, depending on the dependency
+        with span(f"check {dependency.name}", "read", train_id=train_id):
+            should_run = _component_should_run(
+                dependency,
+                dependency.component,
+                is_before,
+                period,
+                storage_manager,
+                train_id,
+                runner_persistence,
+                component.name,
+            )
+
+    assert (
+        has_one_not_before
+    ), "At least one dependency should not be before, otherwise the component will always run on the first data"
+
+    # The dependencies are only read if the component runs
+    if not should_run:
+        record_phase(component.name, train_id, "read", time.perf_counter() - read_start)
+        flush_metrics()
+
+        return advanced
+
+    for dependency in component.dependencies:
+        period, limit = reads[dependency.name]
+
         # Different from the dependency name, which is the name of the component + _before if before is True,
         # the component name is the name of the component without the _before suffix, used to retrieve the data,
         # while the dependency name is used for running the component.
         component_name = dependency.component
 
-        # Check if the component should run, depending on the dependency
-        should_run = should_run and _component_should_run(
-            dependency,
-            component_name,
-            is_before,
-            period,
-            storage_manager,
-            train_id,
-        )
+        with span(f"read {dependency.name}", "read", train_id=train_id) as args:
+            data[dependency.name] = _get_data_from_dependency(
+                component,
+                component_name,
+                dependency,
+                dependency.before,
+                limit,
+                period,
+                storage_manager,
+                train_id,
+            )
 
-        data[dependency.name] = _get_data_from_dependency(
-            component,
-            component_name,
-            dependency,
-            is_before,
-            limit,
-            period,
-            storage_manager,
-            train_id,
-        )
+            if not dependency.stream:
+                args["rows"] = len(data[dependency.name])
+                record_frame(component.name, train_id, "read", data[dependency.name])
 
         if not dependency.before:
             if dependency.frequency:
                 max_timestamps.append(period[1])
+            elif dependency.stream:
+                # The last timestamp of a stream is only known once it is consumed
+                streams.append(data[dependency.name])
             else:
                 max_timestamps.append(data[component_name].index.max())
 
-    assert (
-        has_one_not_before
-    ), "At least one dependency should not be before, otherwise the component will always run on the first data"
+    record_phase(component.name, train_id, "read", time.perf_counter() - read_start)
 
-    if should_run:
-        # Instantiate component
-        instance = _instantiate_component_from_config(component)
-        # Run component
+    record_run(component.name, train_id)
+    # Get the instance of the component, kept between runs
+    instance = _get_component_instance(component, train_id)
+    # Run component (the outputs of a generator are computed while they are stored, outside of the run phase)
+    run_start = time.perf_counter()
+
+    with span(f"run {component.name}", "run", train_id=train_id):
         if component.multiple_outputs:
-            dfs = instance.run(**data)
-            for df in dfs:
-                storage_manager.store(df, component.name, train_id)
+            outputs = instance.run(**data) or []
         else:
-            df = instance.run(**data)
-            storage_manager.store(df, component.name, train_id)
+            outputs = [instance.run(**data)]
+
+    record_phase(component.name, train_id, "run", time.perf_counter() - run_start)
+
+    for df in outputs:
+        _store_output(storage_manager, runner_persistence, component, df, train_id)
+
+    for stream in streams:
+        record_volume(component.name, train_id, "read", stream.rows, stream.bytes)
+
+    peak = peak_rss()
+    # Without /proc, the RSS is not known and the peak is the peak of the process, only the inputs are counted
+    used = peak - rss_before if rss_before else 0
+    record_memory(component.name, train_id, peak, used, scale)
+
+    if component.max_memory:
+        inputs = [
+            (
+                (value.rows, value.bytes)
+                if isinstance(value, _TrackedStream)
+                else (len(value), memory_usage(value))
+            )
+            for value in data.values()
+        ]
+        rows_read = sum(rows for rows, _ in inputs)
+
+        # The inputs are a lower bound, the peak also accounts for the copies made by the component
+        if rows_read:
+            _bytes_per_row[(component.name, train_id)] = (
+                max(used, sum(size for _, size in inputs)) / rows_read
+            )
+
+    max_timestamps.extend(
+        stream.last_timestamp for stream in streams if stream.last_timestamp is not None
+    )
 
-        if max_timestamps:
+    if max_timestamps:
+        with span(
+            f"checkpoint {component.name}",
+            "checkpoint",
+            train_id=train_id,
+            last_timestamp=min(max_timestamps),
+        ):
+            previous_timestamp = runner_persistence.get_last_timestamp(
+                component.name, train_id
+            )
             runner_persistence.register_last_timestamp(
                 component.name, min(max_timestamps), train_id
             )
 
+        record_checkpoint(component.name, train_id, min(max_timestamps))
+        advanced = min(max_timestamps) > previous_timestamp
+
+    flush_metrics()
+
+    return advanced
+
+
+def _store_output(
+    storage_manager: StorageManager,
+    runner_persistence: RunnerPersistence,
+    component: ConfigComponent,
+    df: pd.DataFrame,
+    train_id: str = None,
+):
+    """
+    Store an output of a component, unless the component is not persisted, then run the components fused to it on the
+    output.
+    """
+    if df is None:
+        return
+
+    record_frame(component.name, train_id, "written", df)
+
+    # The last timestamps stored before the output, to find the fused components that missed some of the stored data
+    stored_timestamps = (
+        _last_stored_timestamps(storage_manager, component, df, train_id)
+        if component.persist and component.fused_components
+        else {}
+    )
+
+    if component.persist:
+        store_start = time.perf_counter()
+
+        with span(f"store {component.name}", "store", train_id=train_id, rows=len(df)):
+            storage_manager.store(df, component.name, train_id)
+
+            # The rows are added to the backlog of the components depending on the dataset
+            if train_id is not None:
+                rows = {train_id: len(df)}
+            elif "train_id" in df.columns:
+                rows = df.groupby("train_id").size().to_dict()
+            else:
+                rows = {None: len(df)}
+
+            runner_persistence.increment_backlog(component.name, rows)
+
+        record_phase(
+            component.name, train_id, "store", time.perf_counter() - store_start
+        )
+
+    for fused_component in component.fused_components or []:
+        _run_fused_component(
+            storage_manager,
+            runner_persistence,
+            fused_component,
+            df,
+            train_id,
+            stored_timestamps,
+        )
+
+
+def _last_stored_timestamps(
+    storage_manager: StorageManager,
+    component: ConfigComponent,
+    df: pd.DataFrame,
+    train_id: str = None,
+) -> Dict[Union[str, None], pd.Timestamp]:
+    """Get the last timestamp stored by a component for each train of an output (None for data not related to a train)."""
+    if not component.per_train:
+        return {None: storage_manager.get_last_timestamp(component.name)}
+
+    if train_id is not None:
+        train_ids = [train_id]
+    elif "train_id" in df.columns:
+        train_ids = df["train_id"].unique()
+    else:
+        train_ids = storage_manager.retrieve_train_ids()
+
+    return {
+        train: storage_manager.get_last_timestamp(component.name, train)
+        for train in train_ids
+    }
+
+
+def _catch_up_fused_component(
+    storage_manager: StorageManager,
+    runner_persistence: RunnerPersistence,
+    component: ConfigComponent,
+    train_id: Union[str, None],
+    last_timestamp: pd.Timestamp,
+):
+    """
+    Run a fused component on the data of its dependency read back from the storage, like the components that are not
+    fused, until it processed the data stored until the given timestamp (or it waits for batch_size rows).
+    """
+    logger.warning(
+        "Fused component %s missed data of %s for train %s, catching up from the storage",
+        component.name,
+        component.dependencies[0].component,
+        train_id,
+    )
+
+    while (
+        runner_persistence.get_last_timestamp(component.name, train_id) < last_timestamp
+    ):
+        if not _run_component_once(
+            storage_manager, runner_persistence, component, train_id
+        ):
+            break
+
+
+def _run_fused_component(
+    storage_manager: StorageManager,
+    runner_persistence: RunnerPersistence,
+    component: ConfigComponent,
+    df: pd.DataFrame,
+    train_id: str = None,
+    stored_timestamps: Dict[Union[str, None], pd.Timestamp] = None,
+):
+    """
+    Run a fused component on an output of its dependency, handed over in memory instead of being read back from the
+    storage. The output is passed as the storage would return it: split by train if the component runs per train, as is
+    otherwise (the components not running per train are only fused to components not running per train, whose outputs
+    hold the data of all the trains). The batch size of the dependency is ignored, the component runs on each output and its
+    last timestamp becomes the last timestamp of the output. A failure of the component is logged and recorded in the
+    metrics, it is not raised to the run of the dependency.
+
+    The trains whose last timestamp is behind the data the dependency stored before the output (stored_timestamps, by
+    train), e.g. since it was stored before the component was fused or a run of the component failed, catch up from
+    the storage instead, so the output does not move their last timestamp past data they did not process.
+    """
+    if df.empty:
+        return
+
+    dependency = component.dependencies[0]
+
+    if component.run_per_train and train_id is not None:
+        inputs = {train_id: df.drop(columns=["train_id"], errors="ignore")}
+    elif component.run_per_train and "train_id" in df.columns:
+        inputs = {
+            train: train_df.drop(columns=["train_id"])
+            for train, train_df in df.groupby("train_id")
+        }
+    elif component.run_per_train:
+        # Data not related to a specific train is passed to all the trains
+        inputs = {train: df for train in storage_manager.retrieve_train_ids()}
+    else:
+        inputs = {None: df}
+
+    stored_timestamps = {
+        train: timestamp
+        for train, timestamp in (stored_timestamps or {}).items()
+        if not pd.isna(timestamp)
+    }
+
+    if stored_timestamps and not component.run_per_train:
+        # The component processes the data of all the trains at once
+        stored_timestamps = {None: max(stored_timestamps.values())}
+
+    checkpoints = {}
+
+    for train, input_df in inputs.items():
+        input_df = input_df.sort_index(kind="stable")
+
+        if dependency.columns:
+            # Like the storage, the train_id column is kept
+            input_df = input_df[
+                [
+                    column
+                    for column in input_df.columns
+                    if column in dependency.columns or column == "train_id"
+                ]
+            ]
+
+        data = {
+            dependency.name: (
+                _TrackedStream(iter([input_df])) if dependency.stream else input_df
+            )
+        }
+
+        stored = stored_timestamps.get(train, stored_timestamps.get(None))
+
+        # A failure does not fail the run of the dependency, which already stored its output: the train keeps its
+        # last timestamp, the other trains and fused components are not affected
+        try:
+            if (
+                stored is not None
+                and runner_persistence.get_last_timestamp(component.name, train)
+                < stored
+            ):
+                # The output is stored as well, it is read back with the data the train missed
+                _catch_up_fused_component(
+                    storage_manager,
+                    runner_persistence,
+                    component,
+                    train,
+                    max(stored, input_df.index.max()),
+                )
+                continue
+
+            record_run(component.name, train)
+            record_frame(component.name, train, "read", input_df)
+            run_start = time.perf_counter()
+            instance = _get_component_instance(component, train)
+
+            with span(f"run {component.name}", "run", train_id=train, fused=True):
+                if component.multiple_outputs:
+                    outputs = instance.run(**data) or []
+                else:
+                    outputs = [instance.run(**data)]
+
+            record_phase(component.name, train, "run", time.perf_counter() - run_start)
+
+            for output in outputs:
+                _store_output(
+                    storage_manager, runner_persistence, component, output, train
+                )
+        except Exception as error:
+            logger.error(
+                "Fused component %s failed for train %s",
+                component.name,
+                train,
+                exc_info=error,
+            )
+            record_failure(component.name, train)
+            continue
+
+        checkpoints[(component.name, train)] = input_df.index.max()
+
+    if not checkpoints:
+        return
+
+    # The checkpoints of all the trains are registered in a single transaction
+    with span(f"checkpoint {component.name}", "checkpoint", trains=len(checkpoints)):
+        runner_persistence.register_last_timestamps(checkpoints)
+
+    for (name, train), timestamp in checkpoints.items():
+        record_checkpoint(name, train, timestamp)
+
 
 def _get_data_from_dependency(
     component,
@@ -186,29 +708,43 @@ def _get_data_from_dependency(
     storage_manager,
     train_id,
 ):
+    """
+    Get the data of a dependency, as a dataframe or, if the dependency is streamed, as an iterable of dataframes of
+    stream_batch_size rows.
+    """
     if component.run_per_train and dependency.get_component.per_train:
-        return storage_manager.get_for_train(
-            component_name,
-            train_id,
-            period,
-            limit,
-            invert=is_before,
+        get, iterate, args = (
+            storage_manager.get_for_train,
+            storage_manager.iter_for_train,
+            (component_name, train_id),
         )
     elif dependency.get_component.per_train:
-        return storage_manager.get_for_all_trains(
-            component_name,
-            period,
-            limit,
-            invert=is_before,
+        get, iterate, args = (
+            storage_manager.get_for_all_trains,
+            storage_manager.iter_for_all_trains,
+            (component_name,),
         )
     else:
-        return storage_manager.get_for_agnostic(
-            component_name,
-            period,
-            limit,
-            invert=is_before,
+        get, iterate, args = (
+            storage_manager.get_for_agnostic,
+            storage_manager.iter_for_agnostic,
+            (component_name,),
+        )
+
+    if dependency.stream:
+        return _TrackedStream(
+            iterate(
+                *args,
+                period,
+                limit,
+                invert=is_before,
+                columns=dependency.columns,
+                batch_size=dependency.stream_batch_size,
+            )
         )
 
+    return get(*args, period, limit, invert=is_before, columns=dependency.columns)
+
 
 def _get_starting_timestamp_for_all_dependencies(
     component: ConfigComponent,
@@ -241,31 +777,437 @@ def _get_starting_timestamp_for_all_dependencies(
     return min_timestamp
 
 
+def _notified_train_ids(
+    component: ConfigComponent,
+    notifications: List[Notification],
+    runner_persistence: RunnerPersistence,
+    storage_manager: StorageManager,
+) -> Set[Union[str, None]]:
+    """
+    Get the trains a component should run for after the given notifications (None if the component does not run per
+    train). Notifications of data the component already processed are skipped, and a store of data not related to a
+    train concerns all the trains.
+    """
+    train_ids = set()
+
+    for notification in notifications:
+        train_id = notification.train_id if component.run_per_train else None
+
+        if notification.last_timestamp <= runner_persistence.get_last_timestamp(
+            component.name, train_id
+        ):
+            continue
+
+        if component.run_per_train and train_id is None:
+            return set(storage_manager.retrieve_train_ids())
+
+        train_ids.add(train_id)
+
+    return train_ids
+
+
 def _run_component_for_ever(
     storage_manager: StorageManager,
     runner_persistence: RunnerPersistence,
     component: ConfigComponent,
+    notifications: multiprocessing.Queue = None,
+    wakeup_interval: float = 60,
+    metrics_path: str = None,
+    trace_path: str = None,
 ):
     """
-    Run a component forever. If the component is run per train, then it will run for each train.
+    Run a component forever. If the component is run per train, then it will run for each train, on a pool of
+    max_workers processes if the component sets it (a train is never run twice at the same time).
+
+    With a queue of notifications, the component only runs for the trains whose dependencies stored new data, for as
+    long as each run moves its last timestamp forward (a run reads at most batch_size rows). Otherwise, or if no
+    notification arrives for wakeup_interval seconds, it checks all the trains (the component is polled).
     """
-    while True:
+    if metrics_path:
+        enable_metrics(metrics_path)
+
+    if trace_path:
+        enable_tracing(trace_path)
+
+    pool = None
+
+    if component.run_per_train and (component.max_workers or 1) > 1:
+        pool = ProcessPoolExecutor(
+            component.max_workers,
+            initializer=_initialize_worker,
+            initargs=(
+                storage_manager,
+                runner_persistence,
+                {component.name: component},
+                metrics_path,
+                trace_path,
+                component.max_workers,
+            ),
+        )
+
+    def _run(train_ids) -> Set[Union[str, None]]:
+        """Run the component for the given trains, returning the trains whose last timestamp moved forward."""
+        if pool is None:
+            advanced = set()
+
+            for train_id in train_ids:
+                with span(component.name, "component", train_id=train_id):
+                    if _run_component_once(
+                        storage_manager, runner_persistence, component, train_id
+                    ):
+                        advanced.add(train_id)
+
+            return advanced
+
+        futures = {
+            train_id: pool.submit(_run_task, component.name, train_id)
+            for train_id in train_ids
+        }
+
+        return {train_id for train_id, future in futures.items() if future.result()[0]}
+
+    if notifications is None:
+        # Nothing notifies the components without dependencies (e.g. the source), they are polled
+        while True:
+            if component.run_per_train:
+                _run(storage_manager.retrieve_train_ids())
+            else:
+                _run([None])
+
+            time.sleep(0.1)
+
+    def _all_train_ids():
         if component.run_per_train:
-            ids = storage_manager.retrieve_train_ids()
-            for train_id in ids:
-                _run_component_once(
-                    storage_manager, runner_persistence, component, train_id
-                )
+            return set(storage_manager.retrieve_train_ids())
+        return {None}
+
+    # Catch up with the data stored before the pipeline started
+    pending = _all_train_ids()
+
+    while True:
+        pending = _run(pending)
+
+        with span("wait", "scheduling", pending=len(pending)) as args:
+            received = Notifier.wait(notifications, 0 if pending else wakeup_interval)
+            args["notifications"] = len(received)
+
+        if not pending and not received:
+            # Data written outside the pipeline is not in the backlog, it is counted again
+            runner_persistence.clear_backlog(component.name)
+            pending = _all_train_ids()
         else:
-            _run_component_once(storage_manager, runner_persistence, component)
+            pending |= _notified_train_ids(
+                component, received, runner_persistence, storage_manager
+            )
+
 
-        time.sleep(.1)
+def _stages(components: Dict[str, ConfigComponent]) -> Dict[str, int]:
+    """
+    Get the stage of each component in the dependency graph, by name: 0 for the components without dependencies, one
+    more than the latest stage of their dependencies otherwise. Raises a ValueError if the dependencies form a cycle.
+    """
+    stages = {}
+    visiting = set()
+
+    def _stage(name):
+        if name not in stages:
+            if name in visiting:
+                raise ValueError(f"The dependencies of component {name} form a cycle")
+
+            visiting.add(name)
+            stages[name] = max(
+                (
+                    _stage(dependency.component) + 1
+                    for dependency in components[name].dependencies or []
+                    if dependency.component in components
+                    and dependency.component != name
+                ),
+                default=0,
+            )
+
+        return stages[name]
+
+    for name in components:
+        _stage(name)
+
+    return stages
+
+
+def _dependents(components: Dict[str, ConfigComponent]) -> Dict[str, Set[str]]:
+    """Get the components to run when a dataset is stored (those not only depending on its past), by dataset name."""
+    dependents = {}
+
+    for component in components.values():
+        for dependency in component.dependencies or []:
+            # Fused components are run by their dependency
+            if not dependency.before and not component.fused:
+                dependents.setdefault(dependency.component, set()).add(component.name)
+
+    return dependents
+
+
+def _read_workers(workers: int) -> int:
+    """Get the amount of threads reading the trains in each process of a pool of the given amount of processes."""
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def _initialize_worker(
+    storage_manager: StorageManager,
+    runner_persistence: RunnerPersistence,
+    components: Dict[str, ConfigComponent],
+    metrics_path: str = None,
+    trace_path: str = None,
+    workers: int = 1,
+):
+    """
+    Set the state of a process of a pool of the runner, recording the notifications of its stores (and enabling its
+    metrics and tracing if a folder and trace file are given).
+
+    Unless read_workers is configured, the threads reading the trains concurrently are shared out between the workers
+    of the pool, so the pool does not run more reads at the same time than there are CPUs.
+    """
+    if storage_manager.read_workers is None:
+        storage_manager.read_workers = _read_workers(workers)
+
+    if metrics_path:
+        enable_metrics(metrics_path)
+
+    if trace_path:
+        enable_tracing(trace_path)
+
+    if storage_manager.notifier:
+        storage_manager.notifier.published = []
+    else:
+        storage_manager.notifier = Notifier(record=True)
+
+    _worker_state.update(
+        storage_manager=storage_manager,
+        runner_persistence=runner_persistence,
+        components=components,
+    )
+
+
+def _run_task(name: str, train_id: Union[str, None]) -> Tuple[bool, List[Notification]]:
+    """
+    Run a component once in a process of a pool of the runner. Returns whether the last timestamp of the
+    component moved forward, and the notifications of the stores of the run.
+    """
+    storage_manager = _worker_state["storage_manager"]
+    runner_persistence = _worker_state["runner_persistence"]
+
+    storage_manager.notifier.published.clear()
+
+    with span(name, "component", train_id=train_id):
+        advanced = _run_component_once(
+            storage_manager,
+            runner_persistence,
+            _worker_state["components"][name],
+            train_id,
+        )
+
+    return advanced, list(storage_manager.notifier.published)
+
+
+class Scheduler:
+    """
+    Runs the components as (component, train) tasks on a bounded pool of processes, following the dependency graph of
+    the components, instead of running a process per component.
+
+    A task is queued when a dependency of the component stored new data for the train (the tasks return the
+    notifications of their stores), then queued again for as long as it moves the last timestamp of the component
+    forward. Ready tasks run by stage, upstream components first, so data flows through the pipeline before more data
+    is loaded. A task never runs twice at the same time, and a component never runs more tasks at the same time than
+    its max_workers. Components without dependencies are polled, and all the tasks
+    are queued again when no data was stored for wakeup_interval seconds.
+
+    Attributes:
+        storage_manager (StorageManager): The storage manager of the components.
+        runner_persistence (RunnerPersistence): The persistence of the last timestamps of the components.
+        components (dict): The components to run, by name.
+        workers (int): The amount of processes of the pool (default: the amount of CPUs).
+        wakeup_interval (float): Seconds without store after which all the tasks are queued again.
+        metrics_path (str): Optional, the folder the processes of the pool write their metrics to.
+        trace_path (str): Optional, the trace file the processes of the pool (and the scheduler) write their spans to.
+        stages (dict): The stage of each component in the dependency graph, by name.
+        dependents (dict): The components to run when a dataset is stored, by dataset name.
+
+    Methods:
+        submit(name, train_id): Queues the task of a component for a train, unless it is already queued.
+        submit_component(name): Queues the tasks of a component for all the trains.
+        run(): Runs the tasks forever.
+    """
+
+    def __init__(
+        self,
+        storage_manager: StorageManager,
+        runner_persistence: RunnerPersistence,
+        components: Dict[str, ConfigComponent],
+        workers: int = None,
+        wakeup_interval: float = 60,
+        metrics_path: str = None,
+        trace_path: str = None,
+    ):
+        self.storage_manager = storage_manager
+        self.runner_persistence = runner_persistence
+        self.components = components
+        self.workers = workers or os.cpu_count()
+        self.wakeup_interval = wakeup_interval
+        self.metrics_path = metrics_path
+        self.trace_path = trace_path
+        self.stages = _stages(components)
+        self.dependents = _dependents(components)
+        self._ready = []
+        # The queued tasks, with the time they were queued at (for tracing)
+        self._queued = {}
+        self._running = {}
+        self._running_components = Counter()
+        self._rerun = set()
+        self._polled = []
+        self._sequence = itertools.count()
+        self._last_store = time.monotonic()
+
+    def submit(self, name: str, train_id: str = None):
+        """
+        Queue the task of a component for a train (None if the component does not run per train), unless it is
+        already queued. A running task is queued again once it completes.
+        """
+        task = (name, train_id)
+
+        if task in self._running.values():
+            self._rerun.add(task)
+        elif task not in self._queued:
+            self._queued[task] = trace_start()
+            heapq.heappush(self._ready, (self.stages[name], next(self._sequence), task))
+
+    def submit_component(self, name: str):
+        """
+        Queue the tasks of a component for all the trains (or its single task if it does not run per train). Fused
+        components are not queued, they run in the tasks of their dependency.
+        """
+        if self.components[name].fused:
+            return
+
+        if self.components[name].run_per_train:
+            for train_id in self.storage_manager.retrieve_train_ids():
+                self.submit(name, train_id)
+        else:
+            self.submit(name)
+
+    def _notify(self, notification: Notification):
+        """Queue the tasks of the components depending on a stored dataset."""
+        self._last_store = time.monotonic()
+
+        for name in self.dependents.get(notification.name, ()):
+            if not self.components[name].run_per_train:
+                self.submit(name)
+            elif notification.train_id is None:
+                self.submit_component(name)
+            else:
+                self.submit(name, notification.train_id)
+
+    def _complete(self, future):
+        """Handle a completed task, queueing the tasks it triggered."""
+        task = self._running.pop(future)
+        self._running_components[task[0]] -= 1
+
+        try:
+            advanced, notifications = future.result()
+        except BrokenProcessPool:
+            raise
+        except Exception as error:
+            # The task is attempted again when it is notified or woken up
+            logger.error("Component %s failed for train %s", *task, exc_info=error)
+            advanced, notifications = False, []
+
+        for notification in notifications:
+            self._notify(notification)
+
+        if advanced or task in self._rerun:
+            self._rerun.discard(task)
+            self.submit(*task)
+        elif not self.components[task[0]].dependencies:
+            heapq.heappush(
+                self._polled,
+                (time.monotonic() + _POLL_INTERVAL, next(self._sequence), task),
+            )
+
+    def run(self):
+        """Run the tasks forever, starting with the tasks of all the components for all the trains."""
+        with ProcessPoolExecutor(
+            self.workers,
+            initializer=_initialize_worker,
+            initargs=(
+                self.storage_manager,
+                self.runner_persistence,
+                self.components,
+                self.metrics_path,
+                self.trace_path,
+                self.workers,
+            ),
+        ) as pool:
+            for name in self.components:
+                self.submit_component(name)
+
+            while True:
+                now = time.monotonic()
+
+                while self._polled and self._polled[0][0] <= now:
+                    self.submit(*heapq.heappop(self._polled)[2])
+
+                if now - self._last_store >= self.wakeup_interval:
+                    # Catch up with data that was not notified (e.g. written outside the pipeline), which is not in
+                    # the backlogs either
+                    self.runner_persistence.clear_backlog()
+
+                    for name, component in self.components.items():
+                        if component.dependencies:
+                            self.submit_component(name)
+                    self._last_store = now
+
+                capped = []
+
+                while self._ready and len(self._running) < self.workers:
+                    entry = heapq.heappop(self._ready)
+                    name = entry[2][0]
+
+                    if self._running_components[name] >= (
+                        self.components[name].max_workers or self.workers
+                    ):
+                        capped.append(entry)
+                        continue
+
+                    trace_interval(
+                        "queued",
+                        "scheduling",
+                        entry[1],
+                        self._queued.pop(entry[2]),
+                        component=name,
+                        train_id=entry[2][1],
+                    )
+                    self._running_components[name] += 1
+                    self._running[pool.submit(_run_task, *entry[2])] = entry[2]
+
+                # The tasks of the components running their max_workers tasks wait for one of them to complete
+                for entry in capped:
+                    heapq.heappush(self._ready, entry)
+
+                timeout = self._last_store + self.wakeup_interval - now
+
+                if self._polled:
+                    timeout = min(timeout, self._polled[0][0] - now)
+
+                done, _ = wait(
+                    self._running, timeout=max(timeout, 0), return_when=FIRST_COMPLETED
+                )
+
+                for future in done:
+                    self._complete(future)
 
 
 def run_pipeline(config_path: str = "config.toml"):
     """
-    Run all components in the configuration file in separate processes. (Also instantiates the storage manager and the
-    runner persistence.)
+    Run all components in the configuration file, on the pool of processes of the scheduler or, with the processes
+    scheduler, in separate processes. (Also instantiates the storage manager and the runner persistence.)
 
     :param config_path: The path to the configuration file (default: config.toml)
     :return: None
@@ -273,20 +1215,101 @@ def run_pipeline(config_path: str = "config.toml"):
 
     # Load the global and component configuration
     config = load_config_from_file(config_path)
+
+    if config.scheduler not in _SCHEDULERS:
+        raise ValueError(
+            f"Unknown scheduler {config.scheduler}, use one of {_SCHEDULERS}"
+        )
+
     # Instantiate the storage manager, which handles all data storage for the components
-    storage_manager = StorageManager(config.storage_folder)
+    storage_manager = StorageManager.from_config(config)
     # Instantiate the runner persistence, which handles the persistence of the runner
-    runner_persistence = RunnerPersistence(
-        config.runner_persistence, lock=multiprocessing.Lock()
-    )
+    runner_persistence = RunnerPersistence(config.runner_persistence)
 
-    # Run all components in separate processes
     processes = []
 
+    # The processes running the components write their metrics to the metrics folder, served merged over HTTP
+    if config.metrics_folder:
+        enable_metrics(config.metrics_folder, reset=True)
+
+        if config.metrics_port:
+            serve_metrics(config.metrics_folder, config.metrics_port)
+
+    # The processes (including the scheduler) append their spans to the trace file
+    if config.trace_file:
+        enable_tracing(config.trace_file, reset=True)
+
+    # Run the compaction of the append-only deltas next to the components
+    if config.compaction:
+        process = multiprocessing.Process(
+            target=_run_compaction_for_ever,
+            args=(
+                storage_manager,
+                config.compaction_interval,
+                config.compaction_min_deltas,
+                config.compaction_row_group_size,
+                config.compaction_max_bytes_per_second,
+            ),
+        )
+        processes.append(process)
+        process.start()
+
+    # Apply the retention policies of the datasets next to the components
+    retention_policies = _retention_policies(config)
+
+    if retention_policies:
+        process = multiprocessing.Process(
+            target=_run_retention_for_ever,
+            args=(
+                storage_manager,
+                retention_policies,
+                config.retention_interval,
+                runner_persistence,
+                _consumers(config),
+            ),
+        )
+        processes.append(process)
+        process.start()
+
+    if config.scheduler == "dag":
+        Scheduler(
+            storage_manager,
+            runner_persistence,
+            config.components,
+            workers=config.workers,
+            wakeup_interval=config.wakeup_interval,
+            metrics_path=config.metrics_folder,
+            trace_path=config.trace_file,
+        ).run()
+
+    # Each store notifies the components depending on the dataset, instead of the components polling the storage
+    storage_manager.notifier = Notifier()
+    subscriptions = {
+        component.name: storage_manager.notifier.subscribe(
+            dependency.component
+            for dependency in component.dependencies
+            if not dependency.before
+        )
+        for component in config.components.values()
+        if component.dependencies
+    }
+
+    # Run all components in separate processes (the fused components run in the process of their dependency)
     for component in config.components.values():
+        if component.fused:
+            continue
+
         process = multiprocessing.Process(
             target=_run_component_for_ever,
-            args=(storage_manager, runner_persistence, component),
+            args=(
+                storage_manager,
+                runner_persistence,
+                component,
+                subscriptions.get(component.name),
+                config.wakeup_interval,
+                config.metrics_folder,
+                config.trace_file,
+            ),
         )
         processes.append(process)
         process.start()
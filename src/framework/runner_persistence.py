@@ -1,43 +1,111 @@
 import json
 import os
+import sqlite3
 from datetime import datetime
+from typing import Dict, Iterable, Tuple, Union
 
 import pandas as pd
 
 __all__ = ["RunnerPersistence"]
 
+
 class RunnerPersistence:
     """
-    A class for managing persistence of runner's state.
+    A class for managing persistence of runner's state, in a SQLite database in WAL mode. The processes read the state
+    and write their checkpoints concurrently, each write being a small transaction (instead of a rewrite of the whole
+    state under a global lock). A JSON state written by previous versions, next to the database, is imported once.
+
+    The database also holds the backlog of the components: the amount of rows stored in each of their dependencies (by
+    train) since their last run, incremented by the stores and reset when the components register their last timestamp,
+    so the runner checks whether a component has sufficient data without counting the stored rows.
 
     Attributes:
-        path (str): The file path for storing the runner's state.
-        lock: A lock object for thread-safe operations (default is None).
-        memory (dict): In-memory storage of the runner's state.
+        path (str): The file path for storing the runner's state (the extension of the database is .db).
+        database (str): The file path of the SQLite database.
+        _connection (sqlite3.Connection): The connection of this process to the database, opened on first use.
 
     Methods:
-        update_memory(): Updates the in-memory state from the file.
         register_last_timestamp(component, timestamp, train_id): Registers the last timestamp of a component.
+        register_last_timestamps(timestamps): Registers the last timestamps of components in a single transaction.
         get_did_run(component, train_id): Checks if a component has run.
         get_last_timestamp(component, train_id): Retrieves the last timestamp of a component.
-        acquire_for_lock(): Acquires the lock if it exists.
-        release_lock(): Releases the lock if it exists.
+        get_backlog(component, dataset, train_ids): Retrieves the backlog of a component in a dependency, by train.
+        open_backlog(component, dataset, train_ids): Starts counting the backlog of a component in a dependency.
+        increment_backlog(dataset, rows, component): Adds stored rows to the backlogs of the components.
+        clear_backlog(component): Stops keeping the backlogs of a component (or of all the components).
     """
 
-    def __init__(self, path: str, lock=None):
+    def __init__(self, path: str):
         """
-        Initializes the RunnerPersistence object.
+        Initializes the RunnerPersistence object, creating the database if needed.
         """
         self.path = path
-        self.lock = lock
-        self.memory = {}
-        self.update_memory()
+        self.database = f"{os.path.splitext(path)[0]}.db"
+        self._connection = None
+        self._pid = None
+
+        self._connect()
+
+    def __getstate__(self):
+        # Each process opens its own connection (connections can not be shared between processes)
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self.database = f"{os.path.splitext(self.path)[0]}.db"
+        self._connection = None
+        self._pid = None
+
+    def _connect(self) -> sqlite3.Connection:
+        """Get the connection of this process to the database, opening it (and creating the database) if needed."""
+        if self._connection is None or self._pid != os.getpid():
+            # The persistence may be created before any store created the storage folder
+            os.makedirs(os.path.dirname(self.database) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.database, timeout=60)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # A power loss may lose the last checkpoints (their runs are then made again), not corrupt the database
+            connection.execute("PRAGMA synchronous=NORMAL")
+
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS checkpoints "
+                    "(key TEXT PRIMARY KEY, last_timestamp TEXT NOT NULL) WITHOUT ROWID"
+                )
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS backlog "
+                    "(dataset TEXT, train_id TEXT, component TEXT, rows INTEGER NOT NULL, "
+                    "PRIMARY KEY (dataset, train_id, component)) WITHOUT ROWID"
+                )
+
+            self._connection = connection
+            self._pid = os.getpid()
+            self._import_json()
+
+        return self._connection
 
-    def update_memory(self):
-        """Updates the in-memory state from the file."""
-        if os.path.exists(self.path):
-            with open(self.path, "r") as file:
-                self.memory = json.load(file)
+    def _import_json(self):
+        """Import the JSON state of previous versions, if the database does not hold any state yet."""
+        json_path = f"{os.path.splitext(self.path)[0]}.json"
+
+        if not os.path.exists(json_path):
+            return
+
+        with self._connection:
+            if self._connection.execute("SELECT 1 FROM checkpoints LIMIT 1").fetchone():
+                return
+
+            with open(json_path, "r") as file:
+                memory = json.load(file)
+
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO checkpoints (key, last_timestamp) VALUES (?, ?)",
+                memory.items(),
+            )
+
+    @staticmethod
+    def _key(component: str, train_id: str = None) -> str:
+        """Get the key of the state of a component, for a train."""
+        return f"{component}_{train_id}" if train_id else component
 
     def register_last_timestamp(
         self, component: str, timestamp: pd.Timestamp, train_id: str = None
@@ -45,37 +113,137 @@ class RunnerPersistence:
         """
         Registers the last timestamp for a specified component.
         """
-        self.acquire_for_lock()
-        self.update_memory()
-        key = f"{component}_{train_id}" if train_id else component
-        self.memory[key] = timestamp.isoformat()
+        self.register_last_timestamps({(component, train_id): timestamp})
+
+    def register_last_timestamps(
+        self, timestamps: Dict[Tuple[str, Union[str, None]], pd.Timestamp]
+    ):
+        """
+        Registers the last timestamps of components (by component and train_id) in a single transaction, resetting
+        their backlogs (all the trains of the dependencies of a component that does not run per train).
+        """
+        connection = self._connect()
 
-        with open(self.path, "w") as file:
-            json.dump(self.memory, file)
+        with connection:
+            connection.executemany(
+                "INSERT INTO checkpoints (key, last_timestamp) VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET last_timestamp = excluded.last_timestamp",
+                [
+                    (self._key(component, train_id), timestamp.isoformat())
+                    for (component, train_id), timestamp in timestamps.items()
+                ],
+            )
+            connection.executemany(
+                "DELETE FROM backlog WHERE component = ? AND (? OR train_id = ?)",
+                [
+                    (component, train_id is None, self._train_key(train_id))
+                    for component, train_id in timestamps
+                ],
+            )
 
-        self.release_lock()
+    def _fetch(self, component: str, train_id: str = None) -> Union[str, None]:
+        """Fetch the last timestamp of a component, as stored (None if the component never ran)."""
+        row = (
+            self._connect()
+            .execute(
+                "SELECT last_timestamp FROM checkpoints WHERE key = ?",
+                (self._key(component, train_id),),
+            )
+            .fetchone()
+        )
+
+        return row[0] if row else None
 
     def get_did_run(self, component: str, train_id: str = None) -> bool:
         """
         Checks if a component has run.
         """
-        key = f"{component}_{train_id}" if train_id else component
-        return self.memory.get(key, False)
+        return self._fetch(component, train_id) is not None
 
     def get_last_timestamp(self, component: str, train_id: str = None) -> pd.Timestamp:
         """
         Retrieves the last timestamp for a specified component.
         """
-        key = f"{component}_{train_id}" if train_id else component
+        return pd.Timestamp(self._fetch(component, train_id) or datetime.min)
+
+    @staticmethod
+    def _train_key(train_id) -> str:
+        """Get the key of a train in the backlog (train ids may be read as integers from the data)."""
+        return "" if train_id is None else str(train_id)
+
+    def get_backlog(
+        self, component: str, dataset: str, train_ids: Iterable[Union[str, None]]
+    ) -> Dict[Union[str, None], Union[int, None]]:
+        """
+        Retrieves the amount of rows stored in a dataset since the last run of a component, by train (None for data
+        not related to a train). The backlog is None for the trains it is not counted for (see open_backlog).
+        """
+        rows = dict(
+            self._connect()
+            .execute(
+                "SELECT train_id, rows FROM backlog WHERE dataset = ? AND component = ?",
+                (dataset, component),
+            )
+            .fetchall()
+        )
 
-        return pd.Timestamp(self.memory.get(key, datetime.min))
+        return {train_id: rows.get(self._train_key(train_id)) for train_id in train_ids}
+
+    def open_backlog(
+        self, component: str, dataset: str, train_ids: Iterable[Union[str, None]]
+    ):
+        """
+        Starts counting the backlog of a component in a dataset, for the given trains. The stores made from then on
+        are added to the backlog, the rows stored before must be added with increment_backlog.
+        """
+        connection = self._connect()
 
-    def acquire_for_lock(self):
-        """Acquires the lock if it exists."""
-        if self.lock:
-            self.lock.acquire()
+        with connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO backlog (dataset, train_id, component, rows) VALUES (?, ?, ?, 0)",
+                [
+                    (dataset, self._train_key(train_id), component)
+                    for train_id in train_ids
+                ],
+            )
+
+    def increment_backlog(
+        self,
+        dataset: str,
+        rows: Dict[Union[str, None], int],
+        component: str = None,
+    ):
+        """
+        Adds rows stored in a dataset (by train) to the backlog of a component, or of all the components counting their
+        backlog in the dataset.
+        """
+        connection = self._connect()
+
+        with connection:
+            connection.executemany(
+                "UPDATE backlog SET rows = rows + ? "
+                "WHERE dataset = ? AND train_id = ? AND (? IS NULL OR component = ?)",
+                [
+                    (
+                        amount,
+                        dataset,
+                        self._train_key(train_id),
+                        component,
+                        component,
+                    )
+                    for train_id, amount in rows.items()
+                ],
+            )
+
+    def clear_backlog(self, component: str = None):
+        """
+        Stops keeping the backlogs of a component (or of all the components), so they are counted again from the
+        storage, e.g. to account for data written outside the pipeline.
+        """
+        connection = self._connect()
 
-    def release_lock(self):
-        """Releases the lock if it exists."""
-        if self.lock:
-            self.lock.release()
+        with connection:
+            connection.execute(
+                "DELETE FROM backlog WHERE ? IS NULL OR component = ?",
+                (component, component),
+            )
@@ -1,26 +1,503 @@
+import heapq
+import itertools
 import json
+import logging
 import math
+import operator
 import os
-import shutil
-from datetime import datetime
-from io import BytesIO
-from typing import Tuple, Union, List, Iterable
+import re
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Tuple, Union, List, Iterable, Dict, Iterator, Callable
+
+try:
+    import fcntl
+except ImportError:  # Windows, the updates of train_ids.json are not serialized
+    fcntl = None
+
+try:
+    import duckdb
+except ImportError:  # Optional, only required by StorageManager.query
+    duckdb = None
 
 import pandas as pd
 import pyarrow
+import pyarrow.compute
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from pandas._libs import OutOfBoundsDatetime
+from pandas.tseries.frequencies import to_offset
+
+from src.framework.cache import TableCache
+from src.framework.config import Config, StorageOptions
+from src.framework.manifest import (
+    Manifest,
+    ManifestEntry,
+    _index_column,
+    _open_arrow_file,
+)
+from src.framework.notifications import Notifier
 
 __all__ = ["StorageManager", "Period"]
 
+logger = logging.getLogger(__name__)
+
 Period = Tuple[Union[pd.Timestamp, None], Union[pd.Timestamp, None]]
 
+# A data file is either the base file of a day (2023-01-01.parquet) or a delta written in append-only mode
+# (2023-01-01.<sequence>.parquet), the sequence being sortable in write order. Files of the hot tier are Arrow IPC
+# files (2023-01-01.arrow) following the same naming.
+_DATA_FILE_PATTERN = re.compile(
+    r"^(\d{4}-\d{2}-\d{2})(?:\.([0-9]+-[0-9]+))?\.(?:parquet|arrow)$"
+)
+
+# In the hive layout, each day is a directory (date=2023-01-01) holding a base file (part-0.parquet) and the deltas
+# written in append-only mode (part-<sequence>.parquet), trains being directories too (train_id=<id>).
+_HIVE_DATE_PATTERN = re.compile(r"^date=(\d{4}-\d{2}-\d{2})$")
+_HIVE_PART_PATTERN = re.compile(r"^part-(?:0|([0-9]+-[0-9]+))\.parquet$")
+
+# The sequence of a delta file (in both layouts), sortable in write order
+_DELTA_SEQUENCE_PATTERN = re.compile(r"[.-]([0-9]{20}-[0-9]+)\.(?:parquet|arrow)$")
+
+_LAYOUTS = ("daily", "hive")
+
+
+# Default maximum number of rows per row group of the parquet files written by the stores, so reads of a period or of
+# batch_size rows skip the row groups outside of it (through their statistics) instead of decoding whole days
+_DEFAULT_ROW_GROUP_SIZE = 8192
+
+# Number of times a partition is listed and read again when one of its files disappears while reading it
+_PARTITION_READ_ATTEMPTS = 3
+
+
+def _write_file_atomically(
+    filename,
+    df,
+    options: StorageOptions = None,
+    row_group_size=None,
+    metadata: Dict[str, str] = None,
+):
+    """
+    Write a dataframe to a data file through a hidden temporary file that is then renamed, so readers either see
+    the previous version of the file or the new one, never a partially written file.
+
+    Files ending with .arrow (hot tier) are written as uncompressed Arrow IPC files (Feather v2) so they can be
+    memory-mapped, other files are written as parquet. The encoding (compression, dictionary encoding, row group
+    size) is taken from the storage options of the dataset, the row group size of the options has precedence over the
+    given one (for Arrow IPC files, it is the size of the record batches), parquet files default to row groups of
+    _DEFAULT_ROW_GROUP_SIZE rows. Optional metadata is added to the schema of parquet files.
+    """
+    options = options or StorageOptions()
+    directory, base = os.path.split(filename)
+    tmp_filename = os.path.join(directory, f".{base}.{os.getpid()}.tmp")
+
+    if filename.endswith(".arrow"):
+        feather.write_feather(
+            df,
+            tmp_filename,
+            compression="uncompressed",
+            chunksize=options.row_group_size or row_group_size,
+        )
+    else:
+        table = pyarrow.Table.from_pandas(df)
+        if metadata:
+            table = table.replace_schema_metadata(
+                {
+                    **table.schema.metadata,
+                    **{key.encode(): value.encode() for key, value in metadata.items()},
+                }
+            )
+        pq.write_table(
+            table,
+            tmp_filename,
+            compression=options.compression,
+            compression_level=options.compression_level,
+            use_dictionary=options.use_dictionary,
+            row_group_size=options.row_group_size
+            or row_group_size
+            or _DEFAULT_ROW_GROUP_SIZE,
+        )
+    os.replace(tmp_filename, filename)
+
+
+def _downcast(df, options: StorageOptions = None) -> pd.DataFrame:
+    """Cast the columns of a dataframe to the compact dtypes of the storage options (e.g. int16, category)."""
+    if not options or not options.downcast:
+        return df
+
+    dtypes = {
+        column: dtype
+        for column, dtype in options.downcast.items()
+        if column in df.columns
+    }
+
+    return df.astype(dtypes)
+
+
+def _list_partition_files(directory, date) -> List[str]:
+    """
+    List the files of a single daily partition, the base file first followed by its deltas in write order. The
+    partition is either made of the daily files of the directory or of the date=<date> directory (hive layout).
+    """
+    files = []
+
+    for file in os.listdir(directory):
+        match = _DATA_FILE_PATTERN.match(file)
+        if match and match.group(1) == date:
+            files.append((match.group(2) or "", file))
+
+    hive_directory = os.path.join(directory, f"date={date}")
+    if os.path.isdir(hive_directory):
+        for file in os.listdir(hive_directory):
+            match = _HIVE_PART_PATTERN.match(file)
+            if match:
+                files.append((match.group(1) or "", os.path.join(f"date={date}", file)))
+
+    return [os.path.join(directory, file) for _, file in sorted(files)]
+
+
+def _partition_location(file) -> Tuple[str, str]:
+    """Get the directory listing the partition of a data file (see _list_partition_files) and its date."""
+    directory, base = os.path.split(file)
+
+    if _HIVE_PART_PATTERN.match(base):
+        parent, date_directory = os.path.split(directory)
+        return parent, date_directory[len("date=") :]
+
+    return directory, base[:10]
+
+
+def _base_file(files, extension: str = ".parquet") -> str:
+    """Get the base file of a daily partition from the list of its files."""
+    directory, base = os.path.split(files[0])
+
+    if _HIVE_PART_PATTERN.match(base):
+        return os.path.join(directory, "part-0.parquet")
+
+    return os.path.join(directory, f"{base[:10]}{extension}")
+
+
+def _delta_file(base_file) -> str:
+    """Get the name of a new delta file of the partition of a base file, the deltas being sortable in write order."""
+    directory, base = os.path.split(base_file)
+    stem, extension = os.path.splitext(base)
+    sequence = f"{time.time_ns():020d}-{os.getpid()}"
+
+    if _HIVE_PART_PATTERN.match(base):
+        return os.path.join(directory, f"part-{sequence}{extension}")
+
+    return os.path.join(directory, f"{stem}.{sequence}{extension}")
+
+
+def _period_bounds(period: Period = None) -> Tuple[pd.Timestamp, pd.Timestamp]:
+    """
+    Get the bounds of a period as timestamps that can be compared with the stored timestamps (missing or out of bounds
+    values, such as datetime.min, are replaced by the minimum/maximum timestamp).
+    """
+    bounds = []
+
+    for value, default in zip(
+        period or (None, None), (pd.Timestamp.min, pd.Timestamp.max)
+    ):
+        try:
+            bounds.append(
+                default if value is None else pd.Timestamp(value).as_unit("ns")
+            )
+        except OutOfBoundsDatetime:
+            bounds.append(default)
+
+    return bounds[0], bounds[1]
+
+
+def _filter_period(table: pyarrow.Table, index: str, start, end) -> pyarrow.Table:
+    """Keep the rows of an Arrow table whose timestamp (index column) is within the bounds."""
+    timestamps = table.column(index)
+
+    return table.filter(
+        pyarrow.compute.and_(
+            pyarrow.compute.greater_equal(
+                timestamps, pyarrow.scalar(start, timestamps.type)
+            ),
+            pyarrow.compute.less_equal(
+                timestamps, pyarrow.scalar(end, timestamps.type)
+            ),
+        )
+    )
+
+
+def _iter_arrow_file_tables(
+    file, period: Period = None, invert=False, columns=None
+) -> Iterator[pyarrow.Table]:
+    """
+    Iterate over the record batches of an Arrow IPC file (hot tier) within a period, as Arrow tables. The file is
+    memory-mapped and not compressed, so the batches are neither copied nor decoded before being filtered on the
+    period (the mapping stays valid if the file is replaced or removed in the meantime). The cache is not needed.
+
+    An empty table is yielded first, so callers always know the schema of the file.
+    """
+    reader = _open_arrow_file(file)
+    schema = reader.schema
+    index = _index_column(schema)
+    start, end = _period_bounds(period)
+
+    if columns is not None:
+        columns = [name for name in columns if name in schema.names and name != index]
+
+    empty_table = schema.empty_table()
+    yield empty_table if columns is None else empty_table.select(columns + [index])
+
+    batches = range(reader.num_record_batches)
+    if invert:
+        batches = reversed(batches)
+
+    for batch in batches:
+        table = pyarrow.Table.from_batches([reader.get_batch(batch)])
+
+        if columns is not None:
+            table = table.select(columns + [index])
+
+        yield _filter_period(table, index, start, end)
+
+
+def _iter_file_tables(
+    file, period: Period = None, invert=False, columns=None, cache: TableCache = None
+) -> Iterator[pyarrow.Table]:
+    """
+    Iterate over the row groups of a parquet file within a period, as Arrow tables. The period bounds are pushed down
+    to pyarrow: row groups whose statistics on the timestamp index fall outside the period are never decoded, the
+    others are filtered on the period. Row groups are yielded in reverse order if invert (the rows of each table stay
+    sorted by ascending timestamp). If columns are given, only these columns (and the index) are decoded, columns
+    missing from the file are ignored.
+
+    If a cache is given, the metadata and the decoded row groups (with the columns they were read with, so a projection
+    does not decode nor hold the other columns) are cached, keyed by the path, mtime and size of the file and the set of
+    columns. If the file is replaced between the stat and the read, the newer content ends up under the older key, which
+    only readers of the older file look up.
+
+    Arrow IPC files (hot tier) are read by _iter_arrow_file_tables. An empty table is yielded first, so callers always
+    know the schema of the file.
+    """
+    if file.endswith(".arrow"):
+        yield from _iter_arrow_file_tables(file, period, invert, columns)
+        return
+
+    stat = os.stat(file)
+    key = (file, stat.st_mtime_ns, stat.st_size)
+
+    parquet_file = None
+    metadata = cache.get(key) if cache else None
+
+    if metadata is None:
+        parquet_file = pq.ParquetFile(file)
+        metadata = parquet_file.metadata
+        if cache:
+            cache.put(key, metadata, metadata.serialized_size)
+
+    schema = metadata.schema.to_arrow_schema()
+    index = _index_column(schema)
+    column = schema.get_field_index(index)
+    start, end = _period_bounds(period)
+
+    if columns is not None:
+        columns = [name for name in columns if name in schema.names and name != index]
+
+    # The decoded row groups are cached by set of columns (None for all the columns)
+    projection = None if columns is None else tuple(sorted(columns))
+
+    empty_table = schema.empty_table()
+    yield empty_table if columns is None else empty_table.select(columns + [index])
+
+    row_groups = range(metadata.num_row_groups)
+    if invert:
+        row_groups = reversed(row_groups)
+
+    for row_group in row_groups:
+        statistics = metadata.row_group(row_group).column(column).statistics
+
+        if statistics is not None and statistics.has_min_max:
+            if (
+                pd.Timestamp(statistics.max) < start
+                or pd.Timestamp(statistics.min) > end
+            ):
+                continue
+
+        table = None
+
+        if cache:
+            table = cache.get(key + (row_group, projection))
+
+            # A row group read with all its columns serves any projection
+            if table is None and projection is not None:
+                table = cache.get(key + (row_group, None))
+
+        if table is None:
+            parquet_file = parquet_file or pq.ParquetFile(file, metadata=metadata)
+            table = parquet_file.read_row_group(
+                row_group, columns=columns, use_pandas_metadata=True
+            )
+            if cache:
+                cache.put(key + (row_group, projection), table, table.nbytes)
+
+        if columns is not None:
+            table = table.select(columns + [index])
+
+        yield _filter_period(table, index, start, end)
+
+
+def _read_file(
+    file, period: Period = None, limit=None, invert=False, columns=None, cache=None
+) -> pd.DataFrame:
+    """
+    Read the rows of a data file within a period (see _iter_file_tables), row groups are read until the limit is
+    reached.
+    """
+    tables = []
+    count = 0
+
+    for table in _iter_file_tables(file, period, invert, columns, cache):
+        tables.append(table)
+        count += table.num_rows
+
+        if count >= (limit or math.inf):
+            break
+
+    if invert:
+        tables.reverse()
+
+    return pyarrow.concat_tables(tables).to_pandas()
+
+
+def _read_partition(
+    files, period: Period = None, limit=None, invert=False, columns=None, cache=None
+) -> pd.DataFrame:
+    """
+    Read the files of a daily partition (base file followed by its deltas) into a single dataframe, optionally
+    filtering by a period. When the partition holds deltas, duplicated timestamps are resolved by keeping the most
+    recently written row. The limit is only pushed down to the file when the partition holds a single file.
+
+    The compaction merges deltas into the base file and removes them, if one of the files disappears while reading, the
+    partition is listed again and read from scratch.
+    """
+    for attempt in range(_PARTITION_READ_ATTEMPTS):
+        try:
+            file_limit = limit if len(files) == 1 else None
+            df = pd.concat(
+                [
+                    _read_file(file, period, file_limit, invert, columns, cache)
+                    for file in files
+                ]
+            )
+            break
+        except FileNotFoundError:
+            if attempt == _PARTITION_READ_ATTEMPTS - 1:
+                raise
+            files = _list_partition_files(*_partition_location(files[0]))
+            if not files:
+                return pd.DataFrame()
+
+    if len(files) > 1:
+        df = df[~df.index.duplicated(keep="last")]
+        df.sort_index(inplace=True)
+
+    return df
+
+
+def _merge_partition(
+    files,
+    extension: str = ".parquet",
+    options: StorageOptions = None,
+    row_group_size: int = None,
+    manifest: Manifest = None,
+    transform: Callable[[pd.DataFrame], pd.DataFrame] = None,
+    metadata: Dict[str, str] = None,
+) -> str:
+    """
+    Merge the files of a daily partition into a single sorted and deduplicated base file with the given extension
+    (.parquet or .arrow), then remove the other files, the manifest is updated if given. Readers listing the partition
+    in the meantime either read the merged base file or retry when a file disappears, so they never miss rows.
+
+    The rows can be transformed (e.g. downsampled) before being written, and metadata added to the base file.
+
+    :return: The path of the base file
+    """
+    df = _read_partition(files)
+    df.sort_index(inplace=True)
+
+    if transform:
+        df = transform(df)
 
-def _read_rows_from_files(files, limit, period, invert=False):
+    base_file = _base_file(files, extension)
+    _write_file_atomically(base_file, df, options, row_group_size, metadata)
+
+    merged = [file for file in files if file != base_file]
+
+    if manifest:
+        manifest.record(base_file, df)
+
+    for file in merged:
+        os.remove(file)
+
+    if manifest:
+        manifest.remove(merged)
+
+    return base_file
+
+
+def _count_rows_since(file, timestamp) -> int:
+    """
+    Count the rows of a data file at or after a timestamp. Row groups are counted from their statistics, only the
+    index column of the row groups containing the timestamp is decoded. The index column of Arrow IPC files is
+    memory-mapped and compared as a whole.
+    """
+    if file.endswith(".arrow"):
+        table = _open_arrow_file(file).read_all()
+        timestamps = table.column(_index_column(table.schema))
+        return (
+            pyarrow.compute.sum(
+                pyarrow.compute.greater_equal(
+                    timestamps,
+                    pyarrow.scalar(
+                        _period_bounds((timestamp, None))[0], timestamps.type
+                    ),
+                )
+            ).as_py()
+            or 0
+        )
+
+    parquet_file = pq.ParquetFile(file)
+    index = _index_column(parquet_file.schema_arrow)
+    column = parquet_file.schema_arrow.get_field_index(index)
+
+    count = 0
+
+    for row_group in range(parquet_file.metadata.num_row_groups):
+        metadata = parquet_file.metadata.row_group(row_group)
+        statistics = metadata.column(column).statistics
+
+        if statistics is not None and statistics.has_min_max:
+            if pd.Timestamp(statistics.min) >= timestamp:
+                count += metadata.num_rows
+                continue
+            if pd.Timestamp(statistics.max) < timestamp:
+                continue
+
+        timestamps = parquet_file.read_row_group(row_group, columns=[index])
+        count += int((timestamps.column(0).to_pandas() >= timestamp).sum())
+
+    return count
+
+
+def _read_rows_from_files(
+    partitions, limit, period, invert=False, columns=None, cache=None
+):
     df = pd.DataFrame()
-    for index, file in enumerate(files):
+    for index, files in enumerate(partitions):
         try:
-            new_df = pd.read_parquet(file)
-            new_df = new_df[new_df.index >= period[0]]
-            new_df = new_df[new_df.index <= period[1]]
+            remaining = limit - len(df) if limit else None
+            new_df = _read_partition(files, period, remaining, invert, columns, cache)
 
             if invert:
                 new_df.sort_index(inplace=True, ascending=False)
@@ -30,82 +507,623 @@ def _read_rows_from_files(files, limit, period, invert=False):
             if len(df) >= (limit or math.inf):
                 df = df[:limit]
                 break
-        except pyarrow.lib.ArrowInvalid:
-            pass
-        except OSError:
-            pass
+        except (pyarrow.lib.ArrowInvalid, OSError) as error:
+            logger.warning("Skipping unreadable partition %s: %s", files[0], error)
 
     return df
 
 
+def _iter_rows_from_files(
+    partitions, period, invert=False, columns=None, cache=None
+) -> Iterator[pd.DataFrame]:
+    """
+    Iterate over the rows of partitions, as dataframes sorted by timestamp (descending if invert). Partitions made of
+    a single file are read one row group at a time, partitions holding deltas are merged first.
+    """
+    for files in partitions:
+        try:
+            if len(files) == 1:
+                for table in _iter_file_tables(
+                    files[0], period, invert, columns, cache
+                ):
+                    if table.num_rows:
+                        df = table.to_pandas()
+                        yield df.iloc[::-1] if invert else df
+            else:
+                df = _read_partition(files, period, None, invert, columns, cache)
+                yield df.sort_index(ascending=not invert)
+        except (pyarrow.lib.ArrowInvalid, OSError) as error:
+            logger.warning("Skipping unreadable partition %s: %s", files[0], error)
+
+
+def _rebatch(frames, batch_size, limit=None) -> Iterator[pd.DataFrame]:
+    """Regroup a stream of dataframes into dataframes of batch_size rows (the last one may be smaller), up to limit."""
+    pending = []
+    pending_rows = 0
+    remaining = limit or math.inf
+
+    for frame in frames:
+        frame = frame.iloc[: min(len(frame), remaining)]
+        remaining -= len(frame)
+        pending.append(frame)
+        pending_rows += len(frame)
+
+        while pending_rows >= batch_size:
+            df = pd.concat(pending)
+            yield df.iloc[:batch_size]
+            pending = [df.iloc[batch_size:]]
+            pending_rows -= batch_size
+
+        if not remaining:
+            break
+
+    if pending_rows:
+        yield pd.concat(pending)
+
+
+def _merge_streams(streams, descending=False) -> Iterator[pd.DataFrame]:
+    """
+    Merge streams of dataframes sorted by timestamp into a single sorted stream. Only the current dataframe of each
+    stream is kept in memory: at each step, every row up to the smallest last timestamp of the current dataframes is
+    emitted, and the streams whose dataframe was fully emitted move to their next dataframe.
+    """
+    buffers = {}
+
+    def _refill(key):
+        for frame in streams[key]:
+            if not frame.empty:
+                buffers[key] = frame
+                return
+        buffers.pop(key, None)
+
+    for key in range(len(streams)):
+        _refill(key)
+
+    while buffers:
+        frontier = (max if descending else min)(
+            frame.index[-1] for frame in buffers.values()
+        )
+
+        ready = []
+        for key, frame in list(buffers.items()):
+            if descending:
+                count = int((frame.index >= frontier).sum())
+            else:
+                count = frame.index.searchsorted(frontier, side="right")
+
+            ready.append(frame.iloc[:count])
+
+            if count == len(frame):
+                _refill(key)
+            else:
+                buffers[key] = frame.iloc[count:]
+
+        yield pd.concat(ready).sort_index(ascending=not descending, kind="stable")
+
+
+def _merge_first_rows(frames, limit, descending=False) -> List[pd.DataFrame]:
+    """
+    Keep the first limit rows (by timestamp) of a list of dataframes sorted by timestamp, using a k-way merge on their
+    indexes. Since each dataframe is sorted, the first rows overall are made of the first rows of each dataframe, so
+    the dataframes are only truncated.
+    """
+    frames = [
+        (
+            frame
+            if (
+                frame.index.is_monotonic_decreasing
+                if descending
+                else frame.index.is_monotonic_increasing
+            )
+            else frame.sort_index(ascending=not descending, kind="stable")
+        )
+        for frame in frames
+    ]
+
+    merged = heapq.merge(
+        *[
+            zip(frame.index.asi8, itertools.repeat(position))
+            for position, frame in enumerate(frames)
+        ],
+        key=operator.itemgetter(0),
+        reverse=descending,
+    )
+    counts = Counter(position for _, position in itertools.islice(merged, limit))
+
+    return [frame.iloc[: counts[position]] for position, frame in enumerate(frames)]
+
+
+def _open_hive_dataset(directory, fields: List[str]) -> Union[ds.Dataset, None]:
+    """
+    Open a directory of the hive layout as a single pyarrow dataset, the given fields (train_id, date) being read from
+    the directory names as strings. Hidden files (temporary files, manifests) are ignored. Files are discovered in path
+    order, which is the write order of the files of each partition.
+    """
+    if not os.path.isdir(directory):
+        return None
+
+    partitioning = ds.partitioning(
+        pyarrow.schema([(field, pyarrow.string()) for field in fields]),
+        flavor="hive",
+    )
+
+    return ds.dataset(directory, format="parquet", partitioning=partitioning)
+
+
+def _iter_hive_frames(
+    dataset: ds.Dataset,
+    period: Period = None,
+    invert=False,
+    columns=None,
+    by_date=True,
+) -> Iterator[pd.DataFrame]:
+    """
+    Scan a hive partitioned dataset within a period, as dataframes sorted by timestamp (descending if invert). The
+    date partitions outside the period are pruned from the directory names and the period is pushed down to the row
+    groups. If by_date, one scan is done (and one dataframe yielded) per date, so callers can stop as soon as they
+    read enough rows, otherwise the whole period is read by a single multithreaded scan.
+
+    When partitions hold deltas, duplicated timestamps (of the same train) are resolved by keeping the most recently
+    written row. The train_id column, if any, is converted to integers.
+    """
+    if dataset is None or not dataset.files:
+        return
+
+    schema = dataset.schema
+    index = _index_column(schema)
+    start, end = _period_bounds(period)
+
+    dates = set()
+    partition_sizes = Counter()
+    for file in dataset.files:
+        directory = os.path.dirname(file)
+        dates.add(os.path.basename(directory)[len("date=") :])
+        partition_sizes[directory] += 1
+
+    dates = sorted(
+        date for date in dates if str(start.date()) <= date <= str(end.date())
+    )
+    has_deltas = any(size > 1 for size in partition_sizes.values())
+    if columns is None:
+        columns = [name for name in schema.names if name != "date"]
+    else:
+        keys = [index] + (["train_id"] if "train_id" in schema.names else [])
+        columns = [
+            name for name in columns if name in schema.names and name not in keys
+        ] + keys
+
+    timestamp_type = schema.field(index).type
+    row_filter = (ds.field(index) >= pyarrow.scalar(start, timestamp_type)) & (
+        ds.field(index) <= pyarrow.scalar(end, timestamp_type)
+    )
+
+    if "train_id" in schema.names:
+        # Files outside of the train directories are not related to a specific train
+        row_filter &= ds.field("train_id").is_valid()
+
+    if by_date:
+        groups = [[date] for date in (reversed(dates) if invert else dates)]
+    else:
+        groups = [dates] if dates else []
+
+    for group in groups:
+        table = dataset.to_table(
+            columns=columns,
+            filter=row_filter
+            & (ds.field("date") >= group[0])
+            & (ds.field("date") <= group[-1]),
+        )
+
+        if not table.num_rows:
+            continue
+
+        df = table.to_pandas()
+
+        if has_deltas:
+            if "train_id" in df.columns:
+                keys = pd.MultiIndex.from_arrays([df.index, df["train_id"]])
+            else:
+                keys = df.index
+            df = df[~keys.duplicated(keep="last")]
+
+        if "train_id" in df.columns:
+            df["train_id"] = df["train_id"].astype(int)
+
+        yield df.sort_index(ascending=not invert, kind="stable")
+
+
+def _read_hive(
+    dataset: ds.Dataset, period: Period = None, limit=None, invert=False, columns=None
+) -> pd.DataFrame:
+    """
+    Read the rows of a hive partitioned dataset within a period (see _iter_hive_frames). Without a limit, the period
+    is read by a single scan, otherwise the dates are scanned one at a time until the limit is reached.
+    """
+    frames = []
+    count = 0
+
+    for df in _iter_hive_frames(dataset, period, invert, columns, by_date=bool(limit)):
+        frames.append(df)
+        count += len(df)
+
+        if count >= (limit or math.inf):
+            break
+
+    if not frames:
+        return pd.DataFrame()
+
+    df = frames[0] if len(frames) == 1 else pd.concat(frames)
+
+    return df[:limit] if limit else df
+
+
+# Statistics maintained by the rollups for each numeric column, with the function merging two partial values
+_ROLLUP_STATISTICS = {"count": "sum", "sum": "sum", "min": "min", "max": "max"}
+
+
+def _aggregate(df: pd.DataFrame, frequency: str) -> pd.DataFrame:
+    """
+    Aggregate a dataframe into buckets of the given frequency, indexed by the start of the bucket: the amount of rows
+    of each bucket (rows), and the count, sum, min and max of each numeric column (<column>_count, <column>_sum, ...).
+    """
+    buckets = df.index.floor(frequency)
+    aggregated = df.groupby(buckets).size().to_frame("rows")
+
+    numeric = df.select_dtypes("number").drop(columns=["train_id"], errors="ignore")
+    if len(numeric.columns):
+        statistics = numeric.groupby(buckets).agg(list(_ROLLUP_STATISTICS))
+        statistics.columns = [
+            f"{column}_{statistic}" for column, statistic in statistics.columns
+        ]
+        aggregated = aggregated.join(statistics)
+
+    aggregated.index.name = df.index.name
+
+    return aggregated
+
+
+def _merge_aggregates(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """Merge partial aggregates (see _aggregate) of the same buckets into a single row per bucket."""
+    df = pd.concat(frames)
+    functions = {
+        column: (
+            "sum" if column == "rows" else _ROLLUP_STATISTICS[column.rsplit("_", 1)[1]]
+        )
+        for column in df.columns
+    }
+
+    return df.groupby(level=0).agg(functions)
+
+
+def _add_means(df: pd.DataFrame) -> pd.DataFrame:
+    """Add the mean of each column (<column>_mean) to aggregates, from their sum and count."""
+    for column in df.columns:
+        if column.endswith("_sum") and f"{column[:-4]}_count" in df.columns:
+            df[f"{column[:-4]}_mean"] = df[column] / df[f"{column[:-4]}_count"]
+
+    return df
+
+
+def _sql_string(value: str) -> str:
+    """Quote a value as a SQL string literal."""
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _register_dataset(connection, name: str, directory: str, files: List[str]):
+    """
+    Register the files of a dataset as a DuckDB view named after the dataset. Parquet files are scanned directly by
+    DuckDB, Arrow IPC files (hot tier) are memory-mapped and registered as an Arrow table. The index is exposed as a
+    column (named timestamp if the index had no name), and the train_id column is taken from the train directories.
+
+    When the dataset holds deltas, duplicated timestamps (of the same train) are resolved by keeping the most
+    recently written row, as the other reads do (the base file has an empty sequence, so it sorts first).
+    """
+    parquet_files = [file for file in files if file.endswith(".parquet")]
+    arrow_files = [file for file in files if file.endswith(".arrow")]
+
+    sources = []
+
+    if parquet_files:
+        index = _index_column(pq.read_schema(parquet_files[0]))
+        file_list = ", ".join(_sql_string(file) for file in parquet_files)
+        sources.append(
+            f"SELECT * FROM read_parquet([{file_list}], filename = true, union_by_name = true)"
+        )
+
+    if arrow_files:
+        tables = []
+        for file in arrow_files:
+            table = _open_arrow_file(file).read_all()
+            tables.append(
+                table.append_column(
+                    "filename", pyarrow.repeat(pyarrow.scalar(file), table.num_rows)
+                )
+            )
+        index = _index_column(tables[0].schema)
+        connection.register(
+            f"_{name}_hot", pyarrow.concat_tables(tables, promote_options="default")
+        )
+        sources.append(f'SELECT * FROM "_{name}_hot"')
+
+    keys = [f'"{index}"']
+    columns = "* EXCLUDE (filename)"
+
+    if index == "__index_level_0__":
+        columns += f' RENAME ("{index}" AS timestamp)'
+
+    first = os.path.relpath(files[0], directory).split(os.sep)[0]
+
+    if not _DATA_FILE_PATTERN.match(first) and not _HIVE_DATE_PATTERN.match(first):
+        # Per train dataset, the first directory under the dataset is the train (<train_id> or train_id=<train_id>)
+        train_id = (
+            f"CAST(replace(split_part(filename[{len(directory) + 2}:], '/', 1), "
+            "'train_id=', '') AS BIGINT)"
+        )
+        columns += f", {train_id} AS train_id"
+        keys.append(train_id)
+
+    sql = f"SELECT {columns} FROM ({' UNION ALL BY NAME '.join(sources)})"
+
+    if any(_DELTA_SEQUENCE_PATTERN.search(file) for file in files):
+        sequence = f"regexp_extract(filename, {_sql_string(_DELTA_SEQUENCE_PATTERN.pattern)}, 1)"
+        sql += (
+            f" QUALIFY row_number() OVER (PARTITION BY {', '.join(keys)} "
+            f"ORDER BY {sequence} DESC) = 1"
+        )
+
+    connection.execute(f'CREATE VIEW "{name}" AS {sql}')
+
+
 class StorageManager:
     """
     A class for managing storage of data.
 
     Attributes:
         path (str): The file path for storing the data.
+        append_only (bool): Whether stores write immutable delta files instead of rewriting the daily files.
+        read_workers (int): The amount of threads used to read the trains concurrently (None for the default).
+        dataset_options (dict): The storage options (parquet encoding) of each dataset, by name.
+        hot_tier_days (int): Optional, the amount of most recent days kept as memory-mapped Arrow IPC files.
+        layout (str): The layout of the files, daily (<name>/<train_id>/<date>.parquet) or hive
+            (<name>/train_id=<train_id>/date=<date>/part-*.parquet, read as pyarrow datasets).
+        rollups (dict): The frequencies (e.g. 1h, 1D) of the rollups maintained for each dataset, by name.
+        notifier (Notifier): Optional, publishes each store to the processes depending on the dataset.
         _cached_train_ids (set): A set of cached train ids.
+        _manifest (Manifest): The manifests of the stored files (row counts, min/max timestamps, ...).
+        _cache (TableCache): Optional, the LRU cache of the decoded row groups of this process.
 
     Methods:
+        from_config(config): Instantiates a storage manager from the global configuration.
+        _load_train_ids(): Reloads the cached train ids if the train_ids.json file changed.
         _update_train_ids(train_ids): Updates the cached train ids and the train_ids.json file.
-        _append_df_to_parquet(filename, df): Appends new data to an existing parquet file.
+        _append_df_to_file(filename, df): Appends new data to an existing data file.
+        _write_delta(filename, df): Writes new data to a delta file next to the daily file.
+        _file_extension(date, latest): Gets the extension (tier) of the files of a daily partition.
+        _age_out(partitions, latest, name): Moves the partitions that fell out of the hot tier to parquet.
+        _write(directory, date, df, name): Writes data to a daily partition and records it in the manifest.
         _validate_index(data): Ensures that the index is a DateTimeIndex.
         _store_agnostic(date, group, name): Stores data in a single file (data not related to a specific train).
         _store_per_train(date, data, name, train_id): Stores data in a separate file for each train.
         store(data, name, train_id): Stores data in parquet files, optionally grouping by train_id.
+        _update_rollups(name, trains, last_timestamps): Updates the rollups of a dataset with stored data.
+        rollup_frequencies(name): Gets the frequencies of the rollups maintained for a dataset.
+        get_rollup(name, frequency, train_id, period): Gets the pre-aggregated rows of a dataset.
+        _list_partitions(directory, period, invert): Lists the daily partitions of a directory, optionally filtering by a date period.
         _list_files(directory, period, invert): Lists all files in a directory, optionally filtering by a date period.
+        _partition_entries(files): Gets the manifest entries of the files of a daily partition.
         slice_df_with_period(df, period): Slices a dataframe with a period.
-        get_for_train(name, train_id, period, limit, invert): Gets data for a specific train_id, optionally filtering by a date period.
-        get_for_all_trains(name, period, limit, invert): Gets data for all trains, optionally filtering by a date period.
-        get_for_agnostic(name, period, limit, invert): Gets data not related to a specific train, optionally filtering by a date period.
+        get_for_train(name, train_id, period, limit, invert, columns): Gets data for a specific train_id, optionally filtering by a date period.
+        get_for_all_trains(name, period, limit, invert, columns): Gets data for all trains, optionally filtering by a date period.
+        get_for_agnostic(name, period, limit, invert, columns): Gets data not related to a specific train, optionally filtering by a date period.
+        iter_for_train(name, train_id, period, limit, invert, columns, batch_size): Iterates over data for a specific train_id by batches.
+        iter_for_all_trains(name, period, limit, invert, columns, batch_size): Iterates over data for all trains by batches.
+        iter_for_agnostic(name, period, limit, invert, columns, batch_size): Iterates over data not related to a specific train by batches.
+        storage_report(): Gets the amount of files, rows and bytes stored for each dataset.
+        query(sql, parameters): Runs a SQL query over the stored datasets with DuckDB.
+        cache_stats(): Gets the hit/miss counters of the cache of decoded row groups.
         get_first_timestamp(name, train_id): Gets the first timestamp for a specific train_id or for all trains.
         get_last_timestamp(name, train_id): Gets the last timestamp for a specific train_id or for all trains.
+        count_rows_since(timestamp, name, train_id, limit): Counts the rows stored since a given timestamp for a specific train_id or for all trains.
         has_sufficient_data_since(timestamp, amount, name, train_id): Checks if there is sufficient data since a given timestamp for a specific train_id or for all trains.
         retrieve_train_ids(): Retrieves all train_ids.
     """
 
-    def __init__(self, path):
+    def __init__(
+        self,
+        path,
+        append_only: bool = False,
+        read_workers: int = None,
+        cache_max_bytes: int = None,
+        dataset_options: Dict[str, StorageOptions] = None,
+        hot_tier_days: int = None,
+        layout: str = "daily",
+        rollups: Dict[str, List[str]] = None,
+        notifier: Notifier = None,
+    ):
+        if layout not in _LAYOUTS:
+            raise ValueError(f"Unknown storage layout {layout}, use one of {_LAYOUTS}")
+
         self.path = path
+        self.append_only = append_only
+        self.read_workers = read_workers
+        self.dataset_options = dataset_options or {}
+        self.hot_tier_days = hot_tier_days
+        self.layout = layout
+        self.rollups = rollups or {}
+        self.notifier = notifier
         self._cached_train_ids = None
+        self._train_ids_version = None
+        self._manifest = Manifest()
+        self._cache = TableCache(cache_max_bytes) if cache_max_bytes else None
+
+    @classmethod
+    def from_config(cls, config: Config) -> "StorageManager":
+        """Instantiate a storage manager from the global configuration."""
+        return cls(
+            config.storage_folder,
+            append_only=config.append_only,
+            read_workers=config.read_workers,
+            cache_max_bytes=config.cache_max_bytes,
+            dataset_options={
+                name: component.storage
+                for name, component in config.components.items()
+                if component.storage
+            },
+            hot_tier_days=config.hot_tier_days,
+            layout=config.layout,
+            rollups={
+                name: component.rollups
+                for name, component in config.components.items()
+                if component.rollups
+            },
+        )
+
+    def _load_train_ids(self):
+        """Load train_ids.json into the cached train_ids, only if the file changed since it was last loaded."""
+        train_ids_file = f"{self.path}/train_ids.json"
+
+        try:
+            stat = os.stat(train_ids_file)
+        except FileNotFoundError:
+            if self._cached_train_ids is None:
+                self._cached_train_ids = set()
+            return
+
+        version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+        if version != self._train_ids_version:
+            with open(train_ids_file, "r") as file:
+                self._cached_train_ids = set(json.load(file))
+            self._train_ids_version = version
 
     def _update_train_ids(self, train_ids: set):
         """Update cached train_ids and train_ids.json"""
 
+        # Known train_ids do not require any file access
+        if self._cached_train_ids is not None and train_ids <= self._cached_train_ids:
+            return
+
         train_ids_file = f"{self.path}/train_ids.json"
 
-        if os.path.exists(train_ids_file):
-            self._cached_train_ids = set(
-                json.load(open(f"{self.path}/train_ids.json", "r"))
-            )
-        else:
-            self._cached_train_ids = set()
+        with open(f"{train_ids_file}.lock", "a") as lock:
+            # Serialize the updates of the processes, so none of them overwrites the ids added by another one
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+
+            self._load_train_ids()
 
-        # Check if there are new train_ids
-        new_train_ids = train_ids - self._cached_train_ids
+            # Check if there are new train_ids
+            new_train_ids = train_ids - self._cached_train_ids
 
-        if new_train_ids:
-            # Update cached train_ids
-            self._cached_train_ids = self._cached_train_ids.union(new_train_ids)
-            # Update train_ids.json
-            json.dump(list(self._cached_train_ids), open(train_ids_file, "w"))
+            if new_train_ids:
+                # Update train_ids.json (through a tmp file, so readers never see a partial file)
+                tmp_file = f"{self.path}/.train_ids.json.{os.getpid()}.tmp"
+                with open(tmp_file, "w") as file:
+                    json.dump(list(self._cached_train_ids.union(new_train_ids)), file)
+                os.replace(tmp_file, train_ids_file)
+
+                self._load_train_ids()
 
     @staticmethod
-    def _append_df_to_parquet(filename, df):
-        """Append new data to existing parquet file"""
+    def _append_df_to_file(filename, df, options: StorageOptions = None):
+        """Append new data to existing data file"""
         if os.path.exists(filename):
-            current = pd.read_parquet(filename)
+            current = _read_file(filename)
             # Concatenate current and new data
             df = pd.concat([current, df])
             # Drop duplicate dates
             df = df[~df.index.duplicated(keep="last")]
+            # Keep the file sorted (rows overwriting older ones are at the end)
+            df = df.sort_index(kind="stable")
 
-        # Write to parquet tmp file
-        output_buffer = BytesIO()
-        df.to_parquet(output_buffer, engine="pyarrow")
-        output_buffer.seek(0)
-        # Write to parquet file
-        with open(filename, "wb") as f:
-            shutil.copyfileobj(output_buffer, f)
+        # Write to data file (through a tmp file, so readers never see a partial file)
+        _write_file_atomically(filename, df, options)
+
+        return df
+
+    @staticmethod
+    def _write_delta(filename, df, options: StorageOptions = None):
+        """Write new data to an immutable delta file next to the daily file, instead of rewriting the daily file."""
+        delta = _delta_file(filename)
+
+        _write_file_atomically(delta, df, options)
+
+        return delta
+
+    def _file_extension(self, date: str, latest: str) -> str:
+        """
+        Get the extension of the files of a daily partition, given the latest date of its directory: the partitions
+        of the hot_tier_days last days are Arrow IPC files (.arrow), older partitions are parquet files. The hive
+        layout only holds parquet files.
+        """
+        if self.hot_tier_days and self.layout == "daily":
+            age = datetime.strptime(latest, "%Y-%m-%d") - datetime.strptime(
+                date, "%Y-%m-%d"
+            )
+            if age < timedelta(days=self.hot_tier_days):
+                return ".arrow"
+
+        return ".parquet"
+
+    def _age_out(self, partitions, latest: str, name: str):
+        """Move the partitions of a directory that fell out of the hot tier (given its new latest date) to parquet."""
+        for files in partitions:
+            date = _partition_location(files[0])[1]
+
+            if self._file_extension(date, latest) == ".arrow":
+                continue
+
+            if any(file.endswith(".arrow") for file in files):
+                try:
+                    _merge_partition(
+                        files,
+                        ".parquet",
+                        self.dataset_options.get(name),
+                        manifest=self._manifest,
+                    )
+                except (pyarrow.lib.ArrowInvalid, OSError) as error:
+                    logger.warning(
+                        "Could not age out partition %s: %s", files[0], error
+                    )
+
+    def _write(self, directory, date, df, name):
+        """
+        Write data to a daily file, either by rewriting it or by adding a delta (append-only mode), and record the
+        written file in the manifest of its partition. The data is encoded following the storage options of the
+        dataset.
+
+        In the hive layout, the daily file is the base file of the date=<date> directory. With a hot tier (daily
+        layout), the partitions of the last days are written as Arrow IPC files, writing the first partition of a new
+        day moves the partitions that fell out of the hot tier to parquet.
+        """
+        options = self.dataset_options.get(name)
+        df = _downcast(df, options)
+        date = str(date.date())
+
+        if self.layout == "hive":
+            directory = os.path.join(directory, f"date={date}")
+            os.makedirs(directory, exist_ok=True)
+            filename = os.path.join(directory, "part-0.parquet")
+        else:
+            latest = date
+
+            if self.hot_tier_days:
+                partitions = self._list_partitions(directory)
+                last = _partition_location(partitions[-1][0])[1] if partitions else date
+                if date > last:
+                    self._age_out(partitions, date, name)
+                latest = max(date, last)
+
+            filename = os.path.join(
+                directory, f"{date}{self._file_extension(date, latest)}"
+            )
+
+        if self.append_only:
+            filename = self._write_delta(filename, df, options)
+        else:
+            df = self._append_df_to_file(filename, df, options)
+
+        self._manifest.record(filename, df)
 
     @staticmethod
     def _validate_index(data):
@@ -120,12 +1138,17 @@ class StorageManager:
         if not data.index.is_monotonic_increasing:
             raise ValueError("Index must be sorted, use df.sort_index(inplace=True)")
 
+    def _train_directory(self, name: str, train_id) -> str:
+        """Get the directory holding the data of a train, following the layout."""
+        if self.layout == "hive":
+            return f"{self.path}/{name}/train_id={train_id}"
+
+        return f"{self.path}/{name}/{train_id}"
+
     def _store_agnostic(self, date, group, name):
         """Store data in a single file, (data not related to a specific train)"""
 
-        file = f"{self.path}/{name}/{date.date()}.parquet"
-
-        self._append_df_to_parquet(file, group)
+        self._write(f"{self.path}/{name}", date, group, name)
 
     def _store_per_train(self, date, data, name, train_id=None):
         """Store data in a separate file for each train_id"""
@@ -136,10 +1159,8 @@ class StorageManager:
                 df = df.drop(columns=["train_id"])
 
             self._update_train_ids({train})
-            os.makedirs(f"{self.path}/{name}/{train}", exist_ok=True)
-            # Read current file if it exists
-            filename = f"{self.path}/{name}/{train}/{date.date()}.parquet"
-            self._append_df_to_parquet(filename, df)
+            os.makedirs(self._train_directory(name, train), exist_ok=True)
+            self._write(self._train_directory(name, train), date, df, name)
 
         if train_id:
             _inner(train_id, data)
@@ -154,6 +1175,9 @@ class StorageManager:
         If train_id is present in the data, the data is stored in a subdirectory named after the train_id.
         The data is grouped by day, each day is stored in a separate file.
 
+        If rollups are configured for the dataset, they are updated with the stored data (see _update_rollups).
+        The notifier, if any, is then notified of the last stored timestamp of each train.
+
         :param data: The data to store, a DataFrame with a DateTimeIndex
         :param name: The name of the dataset
         :param train_id: Optional, the train_id to group by
@@ -165,6 +1189,18 @@ class StorageManager:
 
         os.makedirs(f"{self.path}/{name}", exist_ok=True)
 
+        if self.rollups.get(name):
+            if train_id:
+                trains = {train_id: data}
+            elif "train_id" in data.columns:
+                trains = dict(list(data.groupby("train_id")))
+            else:
+                trains = {None: data}
+
+            last_timestamps = {
+                train: self.get_last_timestamp(name, train) for train in trains
+            }
+
         # Store each group in a separate file
         for date, group in data.groupby(data.index.floor("d")):
             date: pd.Timestamp
@@ -175,36 +1211,174 @@ class StorageManager:
             else:
                 self._store_agnostic(date, group, name)
 
+        if self.rollups.get(name):
+            self._update_rollups(name, trains, last_timestamps)
+
+        if self.notifier:
+            if train_id:
+                stored_timestamps = {train_id: data.index.max()}
+            elif "train_id" in data.columns:
+                stored_timestamps = (
+                    data.index.to_series().groupby(data["train_id"].values).max()
+                )
+            else:
+                stored_timestamps = {None: data.index.max()}
+
+            for train, last_timestamp in stored_timestamps.items():
+                self.notifier.publish(name, train, last_timestamp)
+
+    def _update_rollups(self, name: str, trains: dict, last_timestamps: dict):
+        """
+        Update the rollups of a dataset (sidecar datasets named <name>_rollup_<frequency>) with data that was just
+        stored, by train (None for data not related to a specific train).
+
+        Data appended after the last stored timestamp is aggregated and merged into the existing rollup rows of its
+        buckets. Data overlapping the stored data may overwrite stored rows, so the buckets it touches are aggregated
+        again from the stored data instead, rows are never counted twice.
+        """
+        for train, df in trains.items():
+            appended = df.index.min() > last_timestamps[train]
+
+            for frequency in self.rollups[name]:
+                rollup = f"{name}_rollup_{frequency}"
+                aggregated = _aggregate(df, frequency)
+                period = (
+                    aggregated.index.min(),
+                    aggregated.index.max()
+                    + pd.Timedelta(to_offset(frequency))
+                    - pd.Timedelta(1, "ns"),
+                )
+
+                if appended:
+                    current = (
+                        self.get_for_train(rollup, train, period)
+                        if train is not None
+                        else self.get_for_agnostic(rollup, period)
+                    )
+                    if not current.empty:
+                        aggregated = _merge_aggregates([current, aggregated])
+                else:
+                    stored = (
+                        self.get_for_train(name, train, period)
+                        if train is not None
+                        else self.get_for_agnostic(name, period)
+                    )
+                    aggregated = _aggregate(stored, frequency)
+
+                self.store(aggregated, rollup, train)
+
+    def rollup_frequencies(self, name: str) -> List[str]:
+        """Get the frequencies of the rollups maintained for a dataset."""
+        return list(self.rollups.get(name, []))
+
+    def get_rollup(
+        self, name: str, frequency: str, train_id: str = None, period: Period = None
+    ) -> pd.DataFrame:
+        """
+        Get the rollup of a dataset at a frequency, for a specific train_id or for all trains (or for the data not
+        related to a specific train). Each row is a bucket indexed by its start, with the amount of rows (rows) and
+        the count, sum, min, max and mean of each numeric column (<column>_count, <column>_sum, ...).
+
+        :param name: The name of the dataset
+        :param frequency: The frequency of the rollup, one of the configured rollups (e.g. 1h, h and 60min are equal)
+        :param train_id: Optional, the train_id to get the rollup for
+        :param period: Optional, the period of the buckets
+        :return: The pre-aggregated rows
+        :raise ValueError: If the rollup is not maintained for the dataset
+        """
+        for configured in self.rollup_frequencies(name):
+            if to_offset(configured) == to_offset(frequency):
+                rollup = f"{name}_rollup_{configured}"
+                break
+        else:
+            raise ValueError(f"No {frequency} rollup is maintained for {name}")
+
+        if train_id:
+            df = self.get_for_train(rollup, train_id, period)
+        else:
+            df = self.get_for_all_trains(rollup, period)
+            if df.empty:
+                df = self.get_for_agnostic(rollup, period)
+
+        return _add_means(df)
+
     @staticmethod
-    def _list_files(
+    def _list_partitions(
         directory: str,
         period: Period = None,
         invert: bool = False,
-    ) -> Iterable[str]:
-        """List all files in a directory, optionally filtering by a date period."""
+    ) -> List[List[str]]:
+        """
+        List the daily partitions of a directory, optionally filtering by a date period. Each partition is the list of
+        its files, the base file first followed by its deltas in write order. Partitions are either daily files or
+        date=<date> directories (hive layout).
+        """
         if not os.path.exists(directory):
             return []
 
-        files = os.listdir(directory)
+        partitions = {}
+
+        for file in os.listdir(directory):
+            match = _DATA_FILE_PATTERN.match(file)
+            if match:
+                date = datetime.strptime(match.group(1), "%Y-%m-%d").date()
+                partitions.setdefault(date, []).append((match.group(2) or "", file))
+                continue
+
+            match = _HIVE_DATE_PATTERN.match(file)
+            if match:
+                date = datetime.strptime(match.group(1), "%Y-%m-%d").date()
+                for part in os.listdir(os.path.join(directory, file)):
+                    part_match = _HIVE_PART_PATTERN.match(part)
+                    if part_match:
+                        partitions.setdefault(date, []).append(
+                            (part_match.group(1) or "", os.path.join(file, part))
+                        )
+
+        dates = list(partitions)
 
         if period:
             start_date, end_date = period
             start_date = start_date or datetime.min
             end_date = end_date or datetime.max
 
-            files = [
-                file
-                for file in files
-                if start_date.date()
-                <= datetime.strptime(file, "%Y-%m-%d.parquet").date()
-                <= end_date.date()
+            dates = [
+                date for date in dates if start_date.date() <= date <= end_date.date()
             ]
 
-        files.sort(
-            key=lambda file: datetime.strptime(file, "%Y-%m-%d.parquet"), reverse=invert
-        )
+        dates.sort(reverse=invert)
+
+        return [
+            [os.path.join(directory, file) for _, file in sorted(partitions[date])]
+            for date in dates
+        ]
+
+    @staticmethod
+    def _list_files(
+        directory: str,
+        period: Period = None,
+        invert: bool = False,
+    ) -> Iterable[str]:
+        """List all files in a directory, optionally filtering by a date period."""
+        return [
+            file
+            for files in StorageManager._list_partitions(directory, period, invert)
+            for file in files
+        ]
 
-        return list(os.path.join(directory, file) for file in files)
+    def _partition_entries(self, files) -> Dict[str, ManifestEntry]:
+        """
+        Get the manifest entries of the files of a daily partition. If all the files vanished in the meantime (merged
+        by the compaction), the partition is listed again.
+        """
+        entries = self._manifest.entries(files)
+
+        if not entries:
+            entries = self._manifest.entries(
+                _list_partition_files(*_partition_location(files[0]))
+            )
+
+        return entries
 
     @staticmethod
     def slice_df_with_period(df, period: Period = None) -> pd.DataFrame:
@@ -226,117 +1400,351 @@ class StorageManager:
         period: Period = None,
         limit: int = None,
         invert: bool = False,
+        columns: List[str] = None,
     ) -> pd.DataFrame:
-        """Get data for a specific train_id, optionally filtering by a date period."""
-        files = self._list_files(f"{self.path}/{name}/{train_id}", period, invert)
-        df = _read_rows_from_files(files, limit, period, invert)
+        """
+        Get data for a specific train_id, optionally filtering by a date period. If columns are given, only these
+        columns are read.
+        """
+        if self.layout == "hive":
+            dataset = _open_hive_dataset(
+                self._train_directory(name, train_id), ["date"]
+            )
+            return _read_hive(dataset, period, limit, invert, columns)
+
+        partitions = self._list_partitions(
+            self._train_directory(name, train_id), period, invert
+        )
+        df = _read_rows_from_files(
+            partitions, limit, period, invert, columns, self._cache
+        )
 
         return self.slice_df_with_period(df, period)
 
     def get_for_all_trains(
-        self, name: str, period: Period = None, limit: int = None, invert: bool = False
+        self,
+        name: str,
+        period: Period = None,
+        limit: int = None,
+        invert: bool = False,
+        columns: List[str] = None,
     ) -> pd.DataFrame:
-        """Get data for all trains, optionally filtering by a date period."""
-
-        df = pd.DataFrame()
+        """
+        Get data for all trains, optionally filtering by a date period. If columns are given, only these columns are
+        read (the train_id column is always added). In the hive layout, all trains are read by a single scan.
+        """
+        if self.layout == "hive":
+            dataset = _open_hive_dataset(f"{self.path}/{name}", ["train_id", "date"])
+            return _read_hive(dataset, period, limit, invert, columns)
 
-        for train_id in self.retrieve_train_ids():
-            train_df = self.get_for_train(name, train_id, period, limit, invert)
+        def _read_train(train_id):
+            train_df = self.get_for_train(
+                name, train_id, period, limit, invert, columns
+            )
             train_df["train_id"] = int(train_id)
-            if train_df.empty:
-                continue
-            df = pd.concat([df, train_df])
+            return train_df
+
+        # Read the trains concurrently (pyarrow releases the GIL while decoding)
+        with ThreadPoolExecutor(max_workers=self.read_workers) as executor:
+            frames = [
+                train_df
+                for train_df in executor.map(_read_train, self.retrieve_train_ids())
+                if not train_df.empty
+            ]
 
-        # Sort by timestamp
-        df.sort_index(inplace=True, ascending=not invert)
+        if not frames:
+            return pd.DataFrame()
 
-        # Keep only first limit rows
+        # Keep only first limit rows (over all trains)
         if limit:
-            df = df[:limit]
+            frames = _merge_first_rows(frames, limit, descending=invert)
+
+        # Concatenate once and sort by timestamp
+        df = pd.concat(frames)
+        df.sort_index(inplace=True, ascending=not invert, kind="stable")
 
         return self.slice_df_with_period(df, period)
 
     def get_for_agnostic(
-        self, name: str, period: Period = None, limit: int = None, invert: bool = False
+        self,
+        name: str,
+        period: Period = None,
+        limit: int = None,
+        invert: bool = False,
+        columns: List[str] = None,
     ) -> pd.DataFrame:
-        """Get data not related to a specific train, optionally filtering by a date period."""
-        files = self._list_files(f"{self.path}/{name}", period, invert)
+        """
+        Get data not related to a specific train, optionally filtering by a date period. If columns are given, only
+        these columns are read.
+        """
+        if self.layout == "hive":
+            dataset = _open_hive_dataset(f"{self.path}/{name}", ["date"])
+            return _read_hive(dataset, period, limit, invert, columns)
+
+        partitions = self._list_partitions(f"{self.path}/{name}", period, invert)
 
-        df = _read_rows_from_files(files, limit, period, invert)
+        df = _read_rows_from_files(
+            partitions, limit, period, invert, columns, self._cache
+        )
 
         return self.slice_df_with_period(df, period)
 
+    def iter_for_train(
+        self,
+        name: str,
+        train_id: str,
+        period: Period = None,
+        limit: int = None,
+        invert: bool = False,
+        columns: List[str] = None,
+        batch_size: int = 10_000,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Iterate over the data of a specific train_id, optionally filtering by a date period. The data is yielded as
+        dataframes of batch_size rows sorted by timestamp (descending if invert), so that arbitrarily large periods can
+        be processed in constant memory.
+        """
+        if self.layout == "hive":
+            dataset = _open_hive_dataset(
+                self._train_directory(name, train_id), ["date"]
+            )
+            return _rebatch(
+                _iter_hive_frames(dataset, period, invert, columns), batch_size, limit
+            )
+
+        partitions = self._list_partitions(
+            self._train_directory(name, train_id), period, invert
+        )
+
+        return _rebatch(
+            _iter_rows_from_files(partitions, period, invert, columns, self._cache),
+            batch_size,
+            limit,
+        )
+
+    def iter_for_all_trains(
+        self,
+        name: str,
+        period: Period = None,
+        limit: int = None,
+        invert: bool = False,
+        columns: List[str] = None,
+        batch_size: int = 10_000,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Iterate over the data of all trains, optionally filtering by a date period. The streams of the trains are
+        merged, so the dataframes of batch_size rows are sorted by timestamp over all trains (descending if invert).
+        In the hive layout, all trains are read by a single scan per date.
+        """
+        if self.layout == "hive":
+            dataset = _open_hive_dataset(f"{self.path}/{name}", ["train_id", "date"])
+            return _rebatch(
+                _iter_hive_frames(dataset, period, invert, columns), batch_size, limit
+            )
+
+        def _iter_train(train_id):
+            for train_df in self.iter_for_train(
+                name, train_id, period, None, invert, columns, batch_size
+            ):
+                yield train_df.assign(train_id=int(train_id))
+
+        streams = [_iter_train(train_id) for train_id in self.retrieve_train_ids()]
+
+        return _rebatch(_merge_streams(streams, invert), batch_size, limit)
+
+    def iter_for_agnostic(
+        self,
+        name: str,
+        period: Period = None,
+        limit: int = None,
+        invert: bool = False,
+        columns: List[str] = None,
+        batch_size: int = 10_000,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Iterate over the data not related to a specific train, optionally filtering by a date period, as dataframes of
+        batch_size rows sorted by timestamp (descending if invert).
+        """
+        if self.layout == "hive":
+            dataset = _open_hive_dataset(f"{self.path}/{name}", ["date"])
+            return _rebatch(
+                _iter_hive_frames(dataset, period, invert, columns), batch_size, limit
+            )
+
+        partitions = self._list_partitions(f"{self.path}/{name}", period, invert)
+
+        return _rebatch(
+            _iter_rows_from_files(partitions, period, invert, columns, self._cache),
+            batch_size,
+            limit,
+        )
+
+    def storage_report(self) -> pd.DataFrame:
+        """
+        Get the amount of files, rows and bytes stored for each dataset (from the manifests), with the compression
+        used to write it.
+        """
+        report = {}
+
+        if not os.path.exists(self.path):
+            return pd.DataFrame()
+
+        for name in sorted(os.listdir(self.path)):
+            if not os.path.isdir(f"{self.path}/{name}"):
+                continue
+
+            files, rows, size = 0, 0, 0
+
+            for directory, _, _ in os.walk(f"{self.path}/{name}"):
+                for partition in self._list_partitions(directory):
+                    entries = self._manifest.entries(partition)
+                    files += len(entries)
+                    rows += sum(entry.rows for entry in entries.values())
+                    size += sum(entry.bytes for entry in entries.values())
+
+            options = self.dataset_options.get(name) or StorageOptions()
+            report[name] = dict(
+                files=files,
+                rows=rows,
+                bytes=size,
+                bytes_per_row=size / rows if rows else None,
+                compression=options.compression,
+            )
+
+        return pd.DataFrame.from_dict(report, orient="index")
+
+    def query(self, sql: str, parameters: list = None) -> pd.DataFrame:
+        """
+        Run a SQL query over the stored datasets with DuckDB (optional dependency, pip install duckdb). Each dataset is
+        exposed as a table named after it, with its index as a column (named timestamp if the index has no name) and
+        a train_id column for the datasets stored per train. Aggregations and joins run in DuckDB, reading the files directly (out-of-core)
+        instead of loading the datasets into pandas.
+
+        Only the datasets referenced by the query are registered, so the other datasets are never listed.
+
+        :param sql: The query, e.g. SELECT train_id, count(*) FROM rpm_and_oil GROUP BY train_id
+        :param parameters: Optional, the values of the ? placeholders of the query
+        :return: The result of the query
+        """
+        if duckdb is None:
+            raise ImportError(
+                "StorageManager.query requires duckdb, install it with pip install duckdb"
+            )
+
+        connection = duckdb.connect()
+
+        try:
+            for name in os.listdir(self.path) if os.path.isdir(self.path) else []:
+                directory = os.path.join(self.path, name)
+
+                if not os.path.isdir(directory) or not re.search(
+                    rf"\b{re.escape(name)}\b", sql
+                ):
+                    continue
+
+                files = [
+                    file
+                    for subdirectory, _, _ in os.walk(directory)
+                    for file in self._list_files(subdirectory)
+                ]
+
+                if files:
+                    _register_dataset(connection, name, directory, files)
+
+            return connection.execute(sql, parameters).df()
+        finally:
+            connection.close()
+
+    def cache_stats(self) -> Dict[str, int]:
+        """Get the hit/miss counters of the cache of decoded row groups (empty if the cache is disabled)."""
+        return self._cache.stats() if self._cache else {}
+
     def get_first_timestamp(self, name: str, train_id: str = None) -> pd.Timestamp:
         """Get the first timestamp for a specific train_id or for all trains"""
         if train_id:
-            files = self._list_files(f"{self.path}/{name}/{train_id}", invert=True)
+            partitions = self._list_partitions(
+                self._train_directory(name, train_id), invert=True
+            )
         else:
-            files = self._list_files(f"{self.path}/{name}", invert=True)
+            partitions = self._list_partitions(f"{self.path}/{name}", invert=True)
 
-        if not files:
+        if not partitions:
             return pd.Timestamp.min
 
-        # Get first file
-        first_file = list(files)[-1]
-
-        # Read first file
-        df = pd.read_parquet(first_file)
-        # Return first timestamp
-        return df.index.min()
+        # Get first timestamp of the first partition from the manifest
+        entries = self._partition_entries(partitions[-1]).values()
+        return min((entry.min for entry in entries if entry.rows), default=pd.NaT)
 
     def get_last_timestamp(self, name: str, train_id: str = None) -> pd.Timestamp:
         """Get the last timestamp for a specific train_id or for all trains"""
         if train_id:
-            files = self._list_files(f"{self.path}/{name}/{train_id}")
+            partitions = self._list_partitions(self._train_directory(name, train_id))
         else:
-            files = self._list_files(f"{self.path}/{name}")
+            partitions = self._list_partitions(f"{self.path}/{name}")
 
-        if not files:
+        if not partitions:
             return pd.Timestamp(datetime.min)
 
-        # Get last file
-        last_file = list(files)[-1]
-
-        # Read last file
-        df = pd.read_parquet(last_file)
-        # Return last timestamp
-        return df.index.max()
+        # Get last timestamp of the last partition from the manifest
+        entries = self._partition_entries(partitions[-1]).values()
+        return max((entry.max for entry in entries if entry.rows), default=pd.NaT)
 
-    def has_sufficient_data_since(
-        self, timestamp: pd.Timestamp, amount: int, name: str, train_id: str = None
-    ) -> bool:
-        """Check if there is sufficient data since a given timestamp for a specific train_id or for all trains"""
+    def count_rows_since(
+        self,
+        timestamp: pd.Timestamp,
+        name: str,
+        train_id: str = None,
+        limit: int = None,
+    ) -> int:
+        """
+        Count the rows stored since a given timestamp for a specific train_id or for all trains, stopping once limit
+        rows are counted. Rows are counted from the manifest, rows overwritten by a later delta are counted twice until
+        the partition is compacted.
+        """
         if train_id:
-            files = self._list_files(
-                f"{self.path}/{name}/{train_id}", (timestamp, None)
+            partitions = self._list_partitions(
+                self._train_directory(name, train_id), (timestamp, None)
             )
         else:
-            files = self._list_files(f"{self.path}/{name}", (timestamp, None))
+            partitions = self._list_partitions(f"{self.path}/{name}", (timestamp, None))
 
         count = 0
-        is_first = True
 
-        for file in files:
+        for files in partitions:
             try:
-                df = pd.read_parquet(file)
-            except pyarrow.lib.ArrowInvalid:
-                continue
-            except OSError:
+                entries = self._partition_entries(files)
+            except (pyarrow.lib.ArrowInvalid, OSError) as error:
+                logger.warning("Skipping unreadable partition %s: %s", files[0], error)
                 continue
 
-            if is_first:
-                df = df[df.index >= timestamp]
+            for file, entry in entries.items():
+                if not entry.rows or entry.max < timestamp:
+                    continue
+
+                if entry.min >= timestamp:
+                    count += entry.rows
+                else:
+                    # Only the files containing the timestamp are (partially) read
+                    count += _count_rows_since(file, timestamp)
+
+                if limit is not None and count >= limit:
+                    return count
 
-            count += len(df)
-            if count >= (amount or 0):
-                return True
-        if count >= (amount or 0):
-            return True
+        return count
 
-        return False
+    def has_sufficient_data_since(
+        self, timestamp: pd.Timestamp, amount: int, name: str, train_id: str = None
+    ) -> bool:
+        """
+        Check if there is sufficient data since a given timestamp for a specific train_id or for all trains (see
+        count_rows_since).
+        """
+        return self.count_rows_since(timestamp, name, train_id, amount or 0) >= (
+            amount or 0
+        )
 
     def retrieve_train_ids(self) -> List[str]:
         """Retrieve all train_ids"""
-        self._update_train_ids(set())
+        self._load_train_ids()
 
         return list(self._cached_train_ids)
@@ -0,0 +1,125 @@
+import contextlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+__all__ = ["enable_tracing"]
+
+# The trace file of this process (None if disabled), see enable_tracing
+_path = None
+
+# The file descriptor of the trace file, opened by each process on its first event
+_file = None
+_pid = None
+
+
+def enable_tracing(path: str, reset: bool = False):
+    """
+    Enable the tracing of this process: its spans are appended to the given trace file, in the JSON array format of
+    the Chrome trace events, loadable in Perfetto (https://ui.perfetto.dev) or chrome://tracing. All the processes
+    append to the same file, each event in a single write. Processes started afterwards (forked) inherit the tracing,
+    spawned processes must enable it as well.
+
+    The array of events is not closed, which the viewers accept (a "]" can be appended to get a valid JSON file).
+
+    :param path: The path of the trace file
+    :param reset: Whether to start a new trace file, removing the events of previous runs
+    """
+    global _path, _file, _pid
+
+    if reset:
+        directory = os.path.dirname(path)
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Every event is written after a comma, so the array starts with the metadata of this process
+        with open(path, "w") as file:
+            file.write("[" + json.dumps(_process_name_event()))
+
+        _file = os.open(path, os.O_WRONLY | os.O_APPEND)
+        _pid = os.getpid()
+
+    _path = path
+
+
+def _process_name_event() -> dict:
+    return {
+        "name": "process_name",
+        "ph": "M",
+        "pid": os.getpid(),
+        "args": {"name": multiprocessing.current_process().name},
+    }
+
+
+def _write(event: dict):
+    """Append an event to the trace file, opening it in this process if needed."""
+    global _file, _pid
+
+    if _file is None or _pid != os.getpid():
+        _file = os.open(_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        _pid = os.getpid()
+        os.write(_file, f",\n{json.dumps(_process_name_event())}".encode())
+
+    os.write(_file, f",\n{json.dumps(event, default=str)}".encode())
+
+
+def _now() -> int:
+    """Get the time of the events, in microseconds (the wall clock, shared by the processes)."""
+    return time.time_ns() // 1000
+
+
+@contextlib.contextmanager
+def span(name: str, category: str, **args):
+    """
+    Trace a span around a block, nested in the spans of the enclosing blocks. The arguments are shown with the span,
+    and the block can add arguments known at its end (e.g. the rows read) to the yielded dictionary.
+    """
+    if _path is None:
+        yield args
+        return
+
+    start = _now()
+
+    try:
+        yield args
+    finally:
+        _write(
+            {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": start,
+                "dur": _now() - start,
+                "pid": os.getpid(),
+                "tid": threading.get_native_id(),
+                "args": args,
+            }
+        )
+
+
+def trace_interval(name: str, category: str, identifier: int, start: int, **args):
+    """
+    Trace an interval that started earlier (at start, see trace_start) and ends now, e.g. the time a task waited in a
+    queue. Intervals are asynchronous events, they may overlap the other spans of the process.
+    """
+    if _path is None:
+        return
+
+    event = {
+        "name": name,
+        "cat": category,
+        "id": identifier,
+        "pid": os.getpid(),
+        "tid": threading.get_native_id(),
+        "args": args,
+    }
+    _write({**event, "ph": "b", "ts": start})
+    _write({**event, "ph": "e", "ts": _now()})
+
+
+def trace_start() -> int:
+    """Get the start of an interval, to trace with trace_interval."""
+    return _now()
@@ -0,0 +1,126 @@
+import pandas as pd
+import pytest
+
+from src.framework import runner
+from src.framework.component import Component
+from src.framework.config import ConfigComponent, ConfigDependency
+from src.framework.runner_persistence import RunnerPersistence
+from src.framework.storage import StorageManager
+
+
+class Copy(Component):
+    def run(self, source: pd.DataFrame) -> pd.DataFrame:
+        return source
+
+
+def _components(batch_size: int) -> dict:
+    components = {}
+    components["source"] = ConfigComponent(
+        name="source", dependencies=[], fused_components=[]
+    )
+    components["copy"] = ConfigComponent(
+        name="copy",
+        component_class="tests.test_backlog.Copy",
+        dependencies=[
+            ConfigDependency("source", batch_size=batch_size, components=components)
+        ],
+        fused_components=[],
+    )
+
+    return components
+
+
+def _store(
+    storage_manager, runner_persistence, component, start: str, rows: int, train="1"
+):
+    index = pd.date_range(start, periods=rows, freq="1min")
+    df = pd.DataFrame({"value": range(rows)}, index=index, dtype=float)
+    runner._store_output(storage_manager, runner_persistence, component, df, train)
+
+
+def test_backlog_is_counted_until_the_next_run(tmp_path):
+    runner_persistence = RunnerPersistence(str(tmp_path / "persistence.db"))
+
+    # The backlog is not kept before it is opened
+    assert runner_persistence.get_backlog("copy", "source", ["1", None]) == {
+        "1": None,
+        None: None,
+    }
+
+    runner_persistence.open_backlog("copy", "source", ["1", None])
+    runner_persistence.open_backlog("other", "source", ["1"])
+    runner_persistence.increment_backlog("source", {"1": 3, None: 2})
+    runner_persistence.increment_backlog("source", {"1": 4}, "copy")
+
+    assert runner_persistence.get_backlog("copy", "source", ["1", None]) == {
+        "1": 7,
+        None: 2,
+    }
+    assert runner_persistence.get_backlog("other", "source", ["1"]) == {"1": 3}
+
+    # A run resets the backlog of its train, the next check counts it again from the storage
+    runner_persistence.register_last_timestamp("copy", pd.Timestamp("2023-01-01"), "1")
+    assert runner_persistence.get_backlog("copy", "source", ["1", None]) == {
+        "1": None,
+        None: 2,
+    }
+
+    runner_persistence.clear_backlog("other")
+    assert runner_persistence.get_backlog("other", "source", ["1"]) == {"1": None}
+
+
+def test_component_waits_for_its_batch(tmp_path, monkeypatch):
+    storage_manager = StorageManager(str(tmp_path / "data"))
+    runner_persistence = RunnerPersistence(str(tmp_path / "persistence.db"))
+    components = _components(batch_size=8)
+    _store(storage_manager, runner_persistence, components["source"], "2023-01-01", 5)
+
+    def _fail(*args, **kwargs):
+        raise AssertionError("The dependency is read without sufficient data")
+
+    # The rows after the first one (the start of the first run) are counted from the storage, then kept in the backlog
+    with monkeypatch.context() as patch:
+        patch.setattr(runner, "_get_data_from_dependency", _fail)
+        assert not runner._run_component_once(
+            storage_manager, runner_persistence, components["copy"], "1"
+        )
+
+    assert runner_persistence.get_backlog("copy", "source", ["1"]) == {"1": 4}
+
+    _store(
+        storage_manager, runner_persistence, components["source"], "2023-01-01 01:00", 5
+    )
+    assert runner_persistence.get_backlog("copy", "source", ["1"]) == {"1": 9}
+
+    assert runner._run_component_once(
+        storage_manager, runner_persistence, components["copy"], "1"
+    )
+    assert len(storage_manager.get_for_train("copy", "1")) == 8
+    assert runner_persistence.get_backlog("copy", "source", ["1"]) == {"1": None}
+
+
+@pytest.mark.parametrize("batch_size, expected", [(2, True), (3, False)])
+def test_backlog_of_all_the_trains(tmp_path, batch_size, expected):
+    storage_manager = StorageManager(str(tmp_path / "data"))
+    runner_persistence = RunnerPersistence(str(tmp_path / "persistence.db"))
+    components = _components(batch_size)
+    _store(storage_manager, runner_persistence, components["source"], "2023-01-01", 3)
+    _store(
+        storage_manager, runner_persistence, components["source"], "2023-01-01", 2, "2"
+    )
+    dependency = components["copy"].dependencies[0]
+
+    # A component not running per train runs once one of the trains has sufficient data
+    assert (
+        runner._component_should_run(
+            dependency,
+            "source",
+            False,
+            (pd.Timestamp("2023-01-01 00:00:01"), pd.Timestamp.now()),
+            storage_manager,
+            None,
+            runner_persistence,
+            "copy",
+        )
+        is expected
+    )
@@ -0,0 +1,138 @@
+import logging
+
+import pandas as pd
+import pytest
+
+from src.framework import runner
+from src.framework.component import Component
+from src.framework.config import _parse_components
+from src.framework.runner_persistence import RunnerPersistence
+from src.framework.storage import StorageManager
+
+# Whether the Flaky component fails
+_failing = False
+
+
+class Double(Component):
+    def run(self, source: pd.DataFrame) -> pd.DataFrame:
+        return source * 2
+
+
+class Flaky(Component):
+    def run(self, source: pd.DataFrame) -> pd.DataFrame:
+        if _failing:
+            raise RuntimeError("boom")
+
+        return source
+
+
+def _components(**fused) -> dict:
+    return _parse_components(
+        {
+            "source": {"class": "tests.test_fused.Double", **fused.get("source", {})},
+            "double": {
+                "class": "tests.test_fused.Double",
+                "fused": True,
+                "dependencies": [{"component": "source"}],
+                **fused.get("double", {}),
+            },
+            "flaky": {
+                "class": "tests.test_fused.Flaky",
+                "fused": True,
+                "dependencies": [{"component": "source"}],
+            },
+        }
+    )
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    storage_manager = StorageManager(str(tmp_path / "data"))
+    runner_persistence = RunnerPersistence(str(tmp_path / "persistence.db"))
+
+    def _store(start: str, trains=("1", "2")):
+        """Store an output of the source for the given trains, 10 rows each."""
+        index = pd.date_range(start, periods=10, freq="1min")
+        df = pd.concat(
+            [
+                pd.DataFrame({"value": range(10), "train_id": train}, index=index)
+                for train in trains
+            ]
+        ).sort_index(kind="stable")
+        runner._store_output(
+            storage_manager, runner_persistence, _components()["source"], df
+        )
+
+    return storage_manager, runner_persistence, _store
+
+
+@pytest.fixture
+def failing(monkeypatch):
+    monkeypatch.setattr(f"{__name__}._failing", True)
+
+
+def test_fused_components_run_on_the_output(pipeline):
+    storage_manager, runner_persistence, store = pipeline
+    store("2023-01-01")
+
+    for train in ("1", "2"):
+        pd.testing.assert_frame_equal(
+            storage_manager.get_for_train("double", train),
+            storage_manager.get_for_train("source", train) * 2,
+        )
+        assert runner_persistence.get_last_timestamp("double", train) == pd.Timestamp(
+            "2023-01-01 00:09"
+        )
+
+
+def test_failing_fused_component_does_not_fail_its_dependency(
+    pipeline, failing, caplog
+):
+    storage_manager, runner_persistence, store = pipeline
+
+    with caplog.at_level(logging.ERROR):
+        store("2023-01-01")
+
+    assert "Fused component flaky failed for train 1" in caplog.text
+    assert "Fused component flaky failed for train 2" in caplog.text
+    assert len(storage_manager.get_for_train("source", "1")) == 10
+    assert not runner_persistence.get_did_run("flaky", "1")
+
+    # The other fused components are not affected
+    assert len(storage_manager.get_for_train("double", "1")) == 10
+    assert runner_persistence.get_last_timestamp("double", "2") == pd.Timestamp(
+        "2023-01-01 00:09"
+    )
+
+
+def test_fused_component_catches_up_after_a_failure(pipeline, monkeypatch, caplog):
+    storage_manager, runner_persistence, store = pipeline
+
+    monkeypatch.setattr(f"{__name__}._failing", True)
+    store("2023-01-01")
+    monkeypatch.setattr(f"{__name__}._failing", False)
+
+    # Both trains missed the first output, train 2 catches up on the next output and train 1 on the one after
+    with caplog.at_level(logging.WARNING):
+        store("2023-01-01 01:00", trains=("2",))
+        store("2023-01-01 02:00")
+
+    assert "Fused component flaky missed data of source for train 1" in caplog.text
+    assert "Fused component flaky missed data of source for train 2" in caplog.text
+
+    # The first run of a component starts after the first row of its dependency
+    flaky = storage_manager.get_for_train("flaky", "2")
+    pd.testing.assert_frame_equal(
+        flaky, storage_manager.get_for_train("source", "2").iloc[1:]
+    )
+    assert runner_persistence.get_last_timestamp("flaky", "2") == pd.Timestamp(
+        "2023-01-01 02:09"
+    )
+    assert len(storage_manager.get_for_train("flaky", "1")) == 19
+
+
+def test_fleet_component_fused_to_a_per_train_component_is_rejected():
+    with pytest.raises(ValueError, match="must run per train"):
+        _components(double={"run_per_train": False})
+
+    _components(source={"run_per_train": False}, double={"run_per_train": False})
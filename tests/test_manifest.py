@@ -0,0 +1,75 @@
+import json
+import os
+
+import pandas as pd
+
+from src.framework.manifest import Manifest
+from src.framework.storage import StorageManager
+
+
+def _store_day(storage_manager: StorageManager, day: str, rows: int = 10):
+    index = pd.date_range(day, periods=rows, freq="min")
+    storage_manager.store(
+        pd.DataFrame({"speed": range(rows)}, index=index), "sensor", "1"
+    )
+
+
+def test_manifest_per_day(tmp_path):
+    storage_manager = StorageManager(str(tmp_path), append_only=True)
+    _store_day(storage_manager, "2023-01-01")
+    _store_day(storage_manager, "2023-01-01 12:00")
+    _store_day(storage_manager, "2023-01-02")
+
+    directory = tmp_path / "sensor" / "1"
+
+    with open(directory / "_manifest.2023-01-01.json") as file:
+        entries = json.load(file)
+
+    assert len(entries) == 2
+    assert all(name.startswith("2023-01-01") for name in entries)
+    assert sum(entry["rows"] for entry in entries.values()) == 20
+
+    # A store only rewrites the manifest of its day
+    mtime_ns = os.stat(directory / "_manifest.2023-01-01.json").st_mtime_ns
+    _store_day(storage_manager, "2023-01-02 12:00")
+    assert os.stat(directory / "_manifest.2023-01-01.json").st_mtime_ns == mtime_ns
+
+    assert storage_manager.get_first_timestamp("sensor", "1") == pd.Timestamp(
+        "2023-01-01"
+    )
+    assert storage_manager.get_last_timestamp("sensor", "1") == pd.Timestamp(
+        "2023-01-02 12:09"
+    )
+
+
+def test_stale_entries_are_rebuilt(tmp_path):
+    storage_manager = StorageManager(str(tmp_path))
+    _store_day(storage_manager, "2023-01-01")
+
+    # The file is rewritten without updating its manifest entry
+    index = pd.date_range("2023-01-01", periods=15, freq="min")
+    pd.DataFrame({"speed": range(15)}, index=index).to_parquet(
+        tmp_path / "sensor" / "1" / "2023-01-01.parquet"
+    )
+
+    assert (
+        storage_manager.count_rows_since(pd.Timestamp("2023-01-01"), "sensor", "1")
+        == 15
+    )
+    assert storage_manager.get_last_timestamp("sensor", "1") == pd.Timestamp(
+        "2023-01-01 00:14"
+    )
+
+
+def test_removing_all_entries_removes_the_manifest(tmp_path):
+    storage_manager = StorageManager(str(tmp_path))
+    _store_day(storage_manager, "2023-01-01")
+    _store_day(storage_manager, "2023-01-02")
+
+    file = tmp_path / "sensor" / "1" / "2023-01-01.parquet"
+    os.remove(file)
+    Manifest().remove([str(file)])
+
+    assert sorted(
+        name for name in os.listdir(tmp_path / "sensor" / "1") if name.startswith("_")
+    ) == ["_manifest.2023-01-02.json"]
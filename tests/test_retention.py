@@ -0,0 +1,73 @@
+import pandas as pd
+import pytest
+
+from src.framework.config import ConfigComponent, RetentionPolicy
+from src.framework.retention import apply_retention
+from src.framework.runner_persistence import RunnerPersistence
+from src.framework.storage import StorageManager
+
+
+def _fill(storage_manager: StorageManager):
+    """Store 8 days of data of a train, a row every 10 minutes."""
+    index = pd.date_range("2023-01-01", "2023-01-08 23:50", freq="10min")
+    storage_manager.store(
+        pd.DataFrame({"speed": range(len(index))}, index=index, dtype=float),
+        "sensor",
+        "1",
+    )
+
+
+def _days(storage_manager: StorageManager) -> list:
+    df = storage_manager.get_for_train("sensor", "1")
+    return sorted({str(day.date()) for day in df.index})
+
+
+@pytest.mark.parametrize("layout", ["daily", "hive"])
+def test_old_partitions_are_deleted(tmp_path, layout):
+    storage_manager = StorageManager(str(tmp_path), layout=layout)
+    _fill(storage_manager)
+
+    apply_retention(storage_manager, {"sensor": RetentionPolicy(raw_days=3)})
+
+    assert _days(storage_manager) == ["2023-01-06", "2023-01-07", "2023-01-08"]
+
+
+def test_old_partitions_are_downsampled(tmp_path):
+    storage_manager = StorageManager(str(tmp_path))
+    _fill(storage_manager)
+    policies = {
+        "sensor": RetentionPolicy(raw_days=2, downsample="1h", delete_after_days=6)
+    }
+
+    apply_retention(storage_manager, policies)
+    df = storage_manager.get_for_train("sensor", "1")
+
+    assert _days(storage_manager) == [f"2023-01-0{day}" for day in range(3, 9)]
+    # The 4 days at least 2 days old hold a row per hour, the 2 others a row every 10 minutes
+    assert len(df) == 4 * 24 + 2 * 144
+    assert df.loc["2023-01-03 01:00", "speed"] == pytest.approx(
+        sum(range(2 * 144 + 6, 2 * 144 + 12)) / 6
+    )
+
+    # The downsampled partitions are not downsampled again
+    apply_retention(storage_manager, policies)
+    pd.testing.assert_frame_equal(storage_manager.get_for_train("sensor", "1"), df)
+
+
+def test_retention_waits_for_the_consumers(tmp_path):
+    storage_manager = StorageManager(str(tmp_path))
+    runner_persistence = RunnerPersistence(str(tmp_path / "persistence.db"))
+    _fill(storage_manager)
+    policies = {"sensor": RetentionPolicy(raw_days=3)}
+    consumers = {"sensor": [ConfigComponent(name="consumer")]}
+
+    # Nothing is deleted before the consumer ran
+    apply_retention(storage_manager, policies, runner_persistence, consumers)
+    assert len(_days(storage_manager)) == 8
+
+    # The ages are counted from the checkpoint of the consumer
+    runner_persistence.register_last_timestamp(
+        "consumer", pd.Timestamp("2023-01-05 12:00"), "1"
+    )
+    apply_retention(storage_manager, policies, runner_persistence, consumers)
+    assert _days(storage_manager) == [f"2023-01-0{day}" for day in range(3, 9)]
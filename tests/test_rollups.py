@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.framework.config import ConfigComponent
+from src.framework.outliers import get_ranking_for_components
+from src.framework.storage import StorageManager
+
+PERIODS = [
+    None,
+    (pd.Timestamp("2023-01-01 21:17:03"), pd.Timestamp("2023-01-02 05:44:10")),
+    (pd.Timestamp("2023-01-01 21:00"), pd.Timestamp("2023-01-02 03:00")),
+    (pd.Timestamp("2023-01-01 21:17"), pd.Timestamp("2023-01-01 21:50")),
+]
+
+
+def _fill(storage_manager: StorageManager):
+    """Store outliers of 3 trains, in several stores per train, the last one overwriting stored rows."""
+    rng = np.random.default_rng(1)
+    start = pd.Timestamp("2023-01-01 20:00")
+
+    for train_id in ("1", "2", "3"):
+        index = pd.date_range(
+            start + pd.Timedelta(seconds=7 * int(train_id)),
+            periods=400 * int(train_id),
+            freq="97s",
+        )
+
+        for part in np.array_split(np.arange(len(index)), 3) + [np.arange(50, 80)]:
+            storage_manager.store(
+                pd.DataFrame(
+                    {
+                        "value": rng.random(len(part)),
+                        "flag": rng.random(len(part)) > 0.5,
+                    },
+                    index=index[part],
+                ),
+                "outliers",
+                train_id,
+            )
+
+
+@pytest.fixture(scope="module")
+def storages(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("rollups"))
+    storage_manager = StorageManager(path, rollups={"outliers": ["1h"]})
+    _fill(storage_manager)
+
+    # The same storage, read without its rollups
+    return storage_manager, StorageManager(path)
+
+
+def test_rollup_matches_raw_data(storages):
+    storage_manager, _ = storages
+
+    for train_id in ("1", "2", "3"):
+        raw = storage_manager.get_for_train("outliers", train_id)
+        rollup = storage_manager.get_rollup("outliers", "1h", train_id)
+        buckets = raw.groupby(raw.index.floor("1h"))
+
+        np.testing.assert_array_equal(rollup["rows"], buckets.size())
+        np.testing.assert_allclose(rollup["value_sum"], buckets["value"].sum())
+        np.testing.assert_allclose(rollup["value_max"], buckets["value"].max())
+
+
+@pytest.mark.parametrize("period", PERIODS)
+@pytest.mark.parametrize("intensity_column", [None, "value", "flag"])
+def test_ranking_from_rollup_matches_raw_ranking(storages, period, intensity_column):
+    storage_manager, raw_storage_manager = storages
+    component = ConfigComponent(name="outliers", intensity_column=intensity_column)
+
+    ranking = get_ranking_for_components([component], storage_manager, period)
+    raw_ranking = get_ranking_for_components([component], raw_storage_manager, period)
+
+    pd.testing.assert_series_equal(
+        ranking.sort_index(), raw_ranking.sort_index(), check_dtype=False
+    )
@@ -0,0 +1,142 @@
+import logging
+from concurrent.futures import Future
+
+import pandas as pd
+import pytest
+
+from src.framework.config import ConfigComponent, ConfigDependency
+from src.framework.notifications import Notification
+from src.framework.runner import Scheduler, _dependents, _stages
+from src.framework.runner_persistence import RunnerPersistence
+from src.framework.storage import StorageManager
+
+
+def _components(*edges, fused=()) -> dict:
+    """Build components from (component, dependency, before) edges."""
+    components = {}
+
+    for name, dependency, before in edges:
+        for _name in (name, dependency):
+            components.setdefault(
+                _name,
+                ConfigComponent(
+                    name=_name,
+                    dependencies=[],
+                    fused_components=[],
+                    fused=_name in fused,
+                ),
+            )
+        components[name].dependencies.append(
+            ConfigDependency(dependency, before=before, components=components)
+        )
+
+    return components
+
+
+@pytest.fixture
+def components() -> dict:
+    return _components(
+        ("clean", "raw", False),
+        ("features", "clean", False),
+        ("features", "features", True),
+        ("model", "features", False),
+        ("model", "raw", False),
+        ("report", "model", True),
+        ("alerts", "model", False),
+        fused=("alerts",),
+    )
+
+
+@pytest.fixture
+def scheduler(tmp_path, components) -> Scheduler:
+    return Scheduler(
+        StorageManager(str(tmp_path / "data")),
+        RunnerPersistence(str(tmp_path / "persistence.db")),
+        components,
+        workers=2,
+    )
+
+
+def test_stages(components):
+    assert _stages(components) == {
+        "clean": 1,
+        "raw": 0,
+        "features": 2,
+        "model": 3,
+        "report": 4,
+        "alerts": 4,
+    }
+
+
+def test_stages_reject_cycles():
+    with pytest.raises(ValueError, match="cycle"):
+        _stages(_components(("a", "b", False), ("b", "c", False), ("c", "a", True)))
+
+
+def test_dependents_skip_the_past_and_the_fused_components(components):
+    assert _dependents(components) == {
+        "raw": {"clean", "model"},
+        "clean": {"features"},
+        "features": {"model"},
+    }
+
+
+def test_tasks_are_queued_once_by_stage(scheduler):
+    scheduler.submit("model", "1")
+    scheduler.submit("clean", "1")
+    scheduler.submit("model", "1")
+    scheduler.submit_component("alerts")
+
+    assert [task for _, _, task in sorted(scheduler._ready)] == [
+        ("clean", "1"),
+        ("model", "1"),
+    ]
+
+
+def _complete(scheduler: Scheduler, task, result=None, error=None):
+    """Complete a running task with a result, or an error."""
+    future = Future()
+    scheduler._running[future] = task
+    scheduler._running_components[task[0]] += 1
+
+    if error:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+    scheduler._complete(future)
+
+
+def test_failed_task_is_not_queued_again(scheduler, caplog):
+    with caplog.at_level(logging.ERROR):
+        _complete(scheduler, ("model", "1"), error=RuntimeError("boom"))
+
+    assert "Component model failed for train 1" in caplog.text
+    assert not scheduler._ready
+    assert not scheduler._running
+    assert scheduler._running_components["model"] == 0
+
+
+def test_completed_task_queues_its_dependents(scheduler):
+    notification = Notification("clean", "1", pd.Timestamp("2023-01-01"))
+    _complete(scheduler, ("clean", "1"), result=(False, [notification]))
+    assert [task for _, _, task in scheduler._ready] == [("features", "1")]
+    scheduler._ready.clear()
+    scheduler._queued.clear()
+
+    # A task moving its last timestamp forward runs again
+    _complete(scheduler, ("clean", "1"), result=(True, []))
+    assert [task for _, _, task in scheduler._ready] == [("clean", "1")]
+
+
+def test_task_notified_while_running_runs_again(scheduler):
+    future = Future()
+    scheduler._running[future] = ("model", "1")
+    scheduler._running_components["model"] += 1
+
+    scheduler.submit("model", "1")
+    assert not scheduler._ready
+
+    future.set_result((False, []))
+    scheduler._complete(future)
+    assert [task for _, _, task in scheduler._ready] == [("model", "1")]
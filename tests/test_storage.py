@@ -0,0 +1,186 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.framework.compaction import compact_storage
+from src.framework.storage import StorageManager
+
+# The storage modes compared with the daily layout, by name: the options of the storage manager, and whether the
+# storage is compacted after each day
+MODES = {
+    "append_only": (dict(append_only=True), False),
+    "compacted": (dict(append_only=True), True),
+    "hot_tier": (dict(hot_tier_days=1), False),
+    "hot_tier_compacted": (dict(append_only=True, hot_tier_days=1), True),
+    "hive": (dict(layout="hive"), False),
+    "hive_compacted": (dict(append_only=True, layout="hive"), True),
+}
+
+PERIODS = [
+    None,
+    (pd.Timestamp("2023-01-01 02:30"), pd.Timestamp("2023-01-02 01:10")),
+    (pd.Timestamp("2023-01-03 00:00"), pd.Timestamp("2023-01-05 00:00")),
+]
+
+
+def _fill(storage_manager: StorageManager, compact: bool = False):
+    """
+    Store the same outputs in a storage: 3 days of 2 trains in 4 stores per day, a last store overwriting rows of the
+    first day, and data not related to a train. The storage is compacted after each day if compact.
+    """
+    rng = np.random.default_rng(0)
+
+    for day in range(3):
+        for store in range(4):
+            index = pd.date_range("2023-01-01", periods=60, freq="min") + pd.Timedelta(
+                days=day, hours=store
+            )
+            storage_manager.store(
+                pd.DataFrame(
+                    {
+                        "speed": rng.random(len(index)),
+                        "rpm": rng.integers(0, 3000, len(index)),
+                        "train_id": [1, 2] * (len(index) // 2),
+                    },
+                    index=index,
+                ),
+                "sensor",
+            )
+            storage_manager.store(
+                pd.DataFrame({"temperature": rng.random(len(index))}, index=index),
+                "weather",
+            )
+
+        if compact:
+            compact_storage(storage_manager, min_deltas=1)
+
+    index = pd.date_range("2023-01-01 02:30", periods=60, freq="min")
+    storage_manager.store(
+        pd.DataFrame(
+            {"speed": -1.0, "rpm": -1, "train_id": [1, 2] * (len(index) // 2)},
+            index=index,
+        ),
+        "sensor",
+    )
+
+
+@pytest.fixture(scope="module")
+def daily(tmp_path_factory):
+    storage_manager = StorageManager(str(tmp_path_factory.mktemp("daily")))
+    _fill(storage_manager)
+
+    return storage_manager
+
+
+@pytest.fixture(scope="module", params=list(MODES))
+def storage(request, tmp_path_factory):
+    options, compact = MODES[request.param]
+    storage_manager = StorageManager(
+        str(tmp_path_factory.mktemp(request.param)), **options
+    )
+    _fill(storage_manager, compact)
+
+    return storage_manager
+
+
+def _assert_equal(df, expected):
+    pd.testing.assert_frame_equal(
+        df.sort_index(axis=1), expected.sort_index(axis=1), check_freq=False
+    )
+
+
+@pytest.mark.parametrize("period", PERIODS)
+@pytest.mark.parametrize("limit, invert", [(None, False), (90, False), (90, True)])
+def test_reads_match_daily_layout(storage, daily, period, limit, invert):
+    _assert_equal(
+        storage.get_for_train("sensor", "1", period, limit, invert),
+        daily.get_for_train("sensor", "1", period, limit, invert),
+    )
+    _assert_equal(
+        storage.get_for_all_trains("sensor", period, limit, invert),
+        daily.get_for_all_trains("sensor", period, limit, invert),
+    )
+    _assert_equal(
+        storage.get_for_agnostic("weather", period, limit, invert),
+        daily.get_for_agnostic("weather", period, limit, invert),
+    )
+
+
+def test_projected_reads_match_daily_layout(storage, daily):
+    _assert_equal(
+        storage.get_for_train("sensor", "2", PERIODS[1], columns=["rpm"]),
+        daily.get_for_train("sensor", "2", PERIODS[1], columns=["rpm"]),
+    )
+
+
+@pytest.mark.parametrize("period", PERIODS)
+def test_streams_match_daily_layout(storage, daily, period):
+    batches = list(storage.iter_for_all_trains("sensor", period, batch_size=100))
+
+    assert all(len(batch) == 100 for batch in batches[:-1])
+    _assert_equal(
+        pd.concat(batches), daily.get_for_all_trains("sensor", period).sort_index()
+    )
+
+
+def test_counts_match_daily_layout(storage, daily):
+    for train_id in ("1", "2"):
+        assert storage.get_first_timestamp(
+            "sensor", train_id
+        ) == daily.get_first_timestamp("sensor", train_id)
+        assert storage.get_last_timestamp(
+            "sensor", train_id
+        ) == daily.get_last_timestamp("sensor", train_id)
+
+    # The rows overwritten by a delta are counted twice until they are compacted, the counts are compared on a dataset
+    # without overwrites
+    for timestamp in (pd.Timestamp("2023-01-01"), pd.Timestamp("2023-01-02 01:30")):
+        assert storage.count_rows_since(timestamp, "weather") == daily.count_rows_since(
+            timestamp, "weather"
+        )
+
+
+def test_compaction_merges_deltas(tmp_path):
+    storage_manager = StorageManager(str(tmp_path), append_only=True)
+    _fill(storage_manager)
+    expected = storage_manager.get_for_all_trains("sensor")
+
+    compact_storage(storage_manager, min_deltas=1)
+
+    for train_id in ("1", "2"):
+        files = sorted(os.listdir(tmp_path / "sensor" / train_id))
+        assert [file for file in files if file.endswith(".parquet")] == [
+            "2023-01-01.parquet",
+            "2023-01-02.parquet",
+            "2023-01-03.parquet",
+        ]
+
+    _assert_equal(storage_manager.get_for_all_trains("sensor"), expected)
+    assert storage_manager.count_rows_since(
+        pd.Timestamp("2023-01-01"), "sensor", "1"
+    ) == len(storage_manager.get_for_train("sensor", "1"))
+
+
+def test_hot_tier_keeps_the_latest_days_in_arrow(tmp_path):
+    storage_manager = StorageManager(str(tmp_path), hot_tier_days=1)
+    _fill(storage_manager)
+
+    assert sorted(
+        file
+        for file in os.listdir(tmp_path / "sensor" / "1")
+        if not file.startswith("_")
+    ) == ["2023-01-01.parquet", "2023-01-02.parquet", "2023-01-03.arrow"]
+
+
+def test_hive_layout_directories(tmp_path):
+    storage_manager = StorageManager(str(tmp_path), layout="hive")
+    _fill(storage_manager)
+
+    assert sorted(os.listdir(tmp_path / "sensor")) == ["train_id=1", "train_id=2"]
+    assert sorted(os.listdir(tmp_path / "sensor" / "train_id=1")) == [
+        "date=2023-01-01",
+        "date=2023-01-02",
+        "date=2023-01-03",
+    ]